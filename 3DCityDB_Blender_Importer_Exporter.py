@@ -12,6 +12,10 @@ bl_info = {
 import bpy
 from bpy.props import (StringProperty,
                        PointerProperty,
+                       IntProperty,
+                       BoolProperty,
+                       EnumProperty,
+                       FloatProperty,
                        )             
 from bpy.types import (Panel,
                        Operator,
@@ -20,176 +24,1650 @@ from bpy.types import (Panel,
 from bpy.utils import (register_class,
                        unregister_class
                        )
+from bpy_extras.io_utils import ExportHelper
+import collections
+import concurrent.futures
+import contextlib
 import ctypes
+import hashlib
+import io
+import itertools
 import json
+import os
+import queue
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+from bpy.app.handlers import persistent
+# attributes written to blender_export besides the geometry
+EXPORT_ATTRIBUTES = ("building_id", "gmlid", "height", "year_of_construction", "year_of_demolition")
+# names of the objects changed since the last export, None when every object has to be compared
+_dirty_objects = None
+# connection pools keyed by (host, database, user), shared by all operators
+_pools = {}
+_pools_lock = threading.Lock()
+# pools replaced after a password change, closed once their last connection is given back
+_retired_pools = []
+POOL_MAX_CONNECTIONS = 8
+# seconds after which an unused pool is closed
+POOL_IDLE_TIMEOUT = 300
+# seconds a connection may rest in the pool before it is checked on reuse
+POOL_HEALTH_CHECK_AGE = 30
+# decoded batches waiting for the main thread in background import
+ASYNC_QUEUE_SIZE = 8
+# seconds between two ticks of background import and the share of a tick spent creating meshes
+ASYNC_TIMER_INTERVAL = 0.1
+ASYNC_FRAME_BUDGET = 0.05
+# loaded tiles keyed by (column, row, size) in least recently seen order
+_tiles = collections.OrderedDict()
+# rough memory use of mesh data per vertex and per face, used for the tile budget
+MESH_BYTES_PER_VERTEX = 64
+MESH_BYTES_PER_FACE = 32
+# upper limit of tiles requested for one view
+MAX_VISIBLE_TILES = 64
+# seconds between two loads of Follow View
+TILE_FOLLOW_INTERVAL = 2.0
+# LoD1 city: one row per building, the LoD1 solid or else the footprint that is extruded by measured_height
+LOD1_SQL = """SELECT b.id AS building_id, co.gmlid AS gmlid, b.measured_height AS height,
+    b.year_of_construction AS year_of_construction, b.year_of_demolition AS year_of_demolition,
+    (SELECT ST_AsBinary(ST_Collect(sg.geometry)) FROM citydb.surface_geometry AS sg
+     WHERE sg.root_id = b.lod1_solid_id AND sg.geometry IS NOT NULL) AS geometry,
+    (SELECT ST_AsBinary(ST_Collect(sg.geometry)) FROM citydb.surface_geometry AS sg
+     WHERE sg.root_id = b.lod0_footprint_id AND sg.geometry IS NOT NULL) AS footprint
+    FROM citydb.building AS b INNER JOIN citydb.cityobject AS co ON (co.id = b.id)
+    ORDER BY b.id"""
+# thematic surfaces of the detailed levels, one row per building
+DETAIL_SQL = """SELECT ts.building_id AS building_id, ST_AsBinary(ST_Collect(sg.geometry)) AS geometry
+    FROM citydb.thematic_surface AS ts INNER JOIN citydb.surface_geometry AS sg ON (sg.root_id = ts.{})
+    WHERE ts.building_id = ANY(%s) AND sg.geometry IS NOT NULL
+    GROUP BY ts.building_id"""
+DETAIL_COLUMNS = {"LOD2": "lod2_multi_surface_id", "LOD3": "lod3_multi_surface_id"}
+# CityJSON vertices are integers in millimetres relative to the scene origin
+CITYJSON_SCALE = 0.001
+# GeoPackage identification and the tables of its core, features go to the buildings table
+GPKG_APPLICATION_ID = 0x47504B47
+GPKG_USER_VERSION = 10300
+# definition of the WGS 84 row every GeoPackage has to contain
+GPKG_WGS84_WKT = ('GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+                  'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+                  'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]')
+GPKG_SCHEMA = """
+CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+    organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+    description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+    min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+    srs_id INTEGER, CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id));
+CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL,
+    geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+    CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+    CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+    CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id));
+CREATE TABLE buildings (fid INTEGER PRIMARY KEY AUTOINCREMENT, geom MULTIPOLYGON, building_id INTEGER,
+    gmlid TEXT, height DOUBLE, year_of_construction TEXT, year_of_demolition TEXT);
+"""
+# attribute columns of the buildings in the scene, without geometry
+ATTRIBUTE_SQL = """SELECT b.id AS building_id, co.gmlid AS gmlid, b.measured_height AS height,
+    b.year_of_construction AS year_of_construction, b.year_of_demolition AS year_of_demolition
+    FROM citydb.building AS b INNER JOIN citydb.cityobject AS co ON (co.id = b.id)
+    WHERE b.id = ANY(%s)"""
+# detailed meshes keyed by (building id, level) in least recently used order, and buildings without them
+_detail_meshes = collections.OrderedDict()
+_missing_detail = set()
+# names of the LoD1 meshes of the LoD city, kept by a fake user like the detailed meshes
+_lod1_meshes = set()
+# detailed meshes kept while not shown, and buildings fetched per detail update
+DETAIL_CACHE_MESHES = 5000
+MAX_DETAIL_FETCH = 500
+# meshes shared by identical geometry keyed by shape hash, names as the datablocks may be deleted
+_shared_meshes = {}
+# seconds, calls and items per pipeline stage of the last operation, shown in the panel
+_stats = collections.OrderedDict()
+_stats_lock = threading.Lock()
 # ------------------------------------------------------------------------
 #    Functions
 # ------------------------------------------------------------------------
 def clearAll():
     """Delete previous objects when a new connection build"""
+    # tiles go with their collections, also those of an earlier session, or they would count as loaded
+    for collection in [collection for collection in bpy.data.collections if "citydb_tile" in collection.keys()]:
+        removeTile(collection)
+    _tiles.clear()
     bpy.ops.object.select_all(action='SELECT')
+    # objects cleared for a new import are not deleted from blender_export
+    releaseObjects(bpy.context.scene, bpy.context.selected_objects)
+    # also those of a LoD city loaded in an earlier session
+    lod1 = [obj["citydb_lod1_mesh"] for obj in bpy.context.selected_objects if "citydb_lod1_mesh" in obj.keys()]
     bpy.ops.object.delete()
+    releaseLodMeshes(lod1)
+    # the next import sets the origin near its own data, unless hidden buildings survived relative to this one
+    scene = bpy.context.scene
+    if "citydb_origin" in scene.keys() and not any("building_id" in obj.keys() for obj in scene.objects):
+        del scene["citydb_origin"]
     return 0
 
-def connectDatabase(db_host, db_name, db_user, db_password, sql):
-    """Connect the database and fetch the data"""
-    con = psycopg2.connect(
-    host=db_host,
-    database=db_name,
-    user=db_user,
-    password=db_password
-    )
+def exportedKeys(scene):
+    """Export keys of the scene objects at the last export, the rows that go when their object is deleted"""
+    return set(scene.get("citydb_exported_keys", "").split())
+
+def releaseObjects(scene, objects):
+    """Forget the export keys of objects removed by the add-on, their blender_export rows are kept"""
+    released = set(obj["export_key"] for obj in objects if "export_key" in obj.keys())
+    if released:
+        scene["citydb_exported_keys"] = " ".join(exportedKeys(scene) - released)
+    return 0
+
+def markChanged(scene):
+    """Count an import or attribute refresh, caches built on the scene objects compare the count"""
+    scene["citydb_generation"] = scene.get("citydb_generation", 0) + 1
+    return 0
+
+def recordStage(stage, seconds, items=0, calls=1):
+    """Add time, calls and processed items to the statistics of a pipeline stage"""
+    # worker threads of background and parallel import record as well
+    with _stats_lock:
+        entry = _stats.setdefault(stage, {"seconds": 0.0, "calls": 0, "items": 0})
+        entry["seconds"] += seconds
+        entry["calls"] += calls
+        entry["items"] += items
+    return 0
+
+@contextlib.contextmanager
+def timedStage(stage, items=0):
+    """Time a block as one call of a stage, the yielded counter can be set to the number of items"""
+    counter = {"items": items}
+    start = time.perf_counter()
+    try:
+        yield counter
+    finally:
+        recordStage(stage, time.perf_counter() - start, counter["items"])
+
+def resetStats():
+    """Forget the statistics of the previous operation"""
+    with _stats_lock:
+        _stats.clear()
+    return 0
+
+def statsSnapshot():
+    """Copy of the statistics that is safe to read while workers record"""
+    with _stats_lock:
+        return [(stage, dict(entry)) for stage, entry in _stats.items()]
+
+def dumpStats(path):
+    """Write the statistics of the last operation to a JSON file"""
+    with open(path, "w") as file:
+        json.dump(collections.OrderedDict(statsSnapshot()), file, indent=2)
+    return 0
+
+def finishStats(scene):
+    """Write the statistics to the file set in the panel, if any"""
+    path = scene.MyProperties.stats_path
+    if path != "":
+        dumpStats(bpy.path.abspath(path))
+    return 0
+
+@contextlib.contextmanager
+def instrumented(scene):
+    """Collect the statistics of one operation"""
+    resetStats()
+    try:
+        yield
+    finally:
+        finishStats(scene)
+
+def retirePool(key):
+    """Take a pool out of use, called with _pools_lock held"""
+    pool = _pools.pop(key)
+    pool["retired"] = True
+    if pool["borrowed"] == 0:
+        pool["pool"].closeall()
+    else:
+        _retired_pools.append(pool)
+    return 0
+
+def getPool(db_host, db_name, db_user, db_password):
+    """Return the connection pool of the database, creating it on first use"""
+    key = (db_host, db_name, db_user)
+    with _pools_lock:
+        pool = _pools.get(key)
+        # a changed password invalidates the pooled sessions
+        if pool is not None and pool["password"] != db_password:
+            retirePool(key)
+            pool = None
+        if pool is not None:
+            pool["borrowed"] += 1
+            pool["used"] = time.monotonic()
+            return pool
+    # the first connection is opened without the lock, other threads keep borrowing meanwhile
+    created = ThreadedConnectionPool(1, POOL_MAX_CONNECTIONS, host=db_host, database=db_name,
+                                     user=db_user, password=db_password)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and pool["password"] != db_password:
+            retirePool(key)
+            pool = None
+        if pool is None:
+            pool = {"pool": created, "password": db_password, "borrowed": 0, "returned": {}}
+            _pools[key] = pool
+            created = None
+        pool["borrowed"] += 1
+        pool["used"] = time.monotonic()
+    # another thread created the pool first
+    if created is not None:
+        created.closeall()
+    return pool
+
+def isAlive(con):
+    """Check a pooled connection with a trivial query"""
+    try:
+        with con.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+        con.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+@contextlib.contextmanager
+def pooledConnection(db_host, db_name, db_user, db_password):
+    """Borrow a healthy connection from the pool of the database and give it back afterwards"""
+    pool = getPool(db_host, db_name, db_user, db_password)
+    con = None
+    try:
+        with timedStage("connect"):
+            con = pool["pool"].getconn()
+            # connections that were idle for a while may have been dropped by the server
+            returned = pool["returned"].pop(id(con), None)
+            if con.closed or (returned is not None and time.monotonic() - returned > POOL_HEALTH_CHECK_AGE
+                              and not isAlive(con)):
+                pool["pool"].putconn(con, close=True)
+                con = pool["pool"].getconn()
+        yield con
+    finally:
+        if con is not None:
+            if not con.closed:
+                try:
+                    con.rollback()
+                except psycopg2.Error:
+                    pass
+            pool["pool"].putconn(con, close=bool(con.closed))
+            pool["returned"][id(con)] = time.monotonic()
+        with _pools_lock:
+            pool["borrowed"] -= 1
+            pool["used"] = time.monotonic()
+            if pool["borrowed"] == 0 and pool.get("retired"):
+                pool["pool"].closeall()
+                _retired_pools[:] = [retired for retired in _retired_pools if retired is not pool]
+
+def evictIdlePools():
+    """Close the pools that have not been used for POOL_IDLE_TIMEOUT seconds"""
+    with _pools_lock:
+        for key, pool in list(_pools.items()):
+            if pool["borrowed"] == 0 and time.monotonic() - pool["used"] > POOL_IDLE_TIMEOUT:
+                pool["pool"].closeall()
+                del _pools[key]
+    # interval of the bpy.app.timers callback
+    return 60.0
+
+def closePools():
+    """Close all pooled connections"""
+    with _pools_lock:
+        for pool in list(_pools.values()) + _retired_pools:
+            pool["pool"].closeall()
+        _pools.clear()
+        _retired_pools.clear()
+    return 0
+
+def fetchBatches(con, sql, itersize, params=None):
+    """Fetch the query result in batches through a server-side cursor"""
+    # a named cursor keeps the result set on the server, only one batch is held in memory
+    with con.cursor(name="citydb_import", cursor_factory=RealDictCursor) as cursor:
+        cursor.itersize = itersize
+        # DECLARE ... CURSOR FOR does not accept a trailing semicolon
+        with timedStage("query"):
+            cursor.execute(sql.strip().rstrip(";"), params)
+        while True:
+            # the server runs the query while the first batch is fetched
+            with timedStage("fetch") as counter:
+                rows = cursor.fetchmany(itersize)
+                counter["items"] = len(rows)
+            if not rows:
+                break
+            yield rows
+
+def streamDatabase(db_host, db_name, db_user, db_password, sql, itersize, params=None):
+    """Connect the database and fetch the data in batches through a server-side cursor"""
+    with pooledConnection(db_host, db_name, db_user, db_password) as con:
+        yield from fetchBatches(con, sql, itersize, params)
+
+def batched(iterable, size):
+    """Split an iterable into lists of at most size items"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            break
+        yield batch
+
+def cacheDirectory():
+    """Directory of the geometry cache in the Blender configuration folder"""
+    return bpy.utils.user_resource('CONFIG', path="3dcitydb_cache", create=True)
+
+def changeToken(con):
+    """Value that changes whenever city objects are added, removed or modified"""
+    with con.cursor() as cursor:
+        cursor.execute("SELECT max(last_modification_date), count(*) FROM citydb.cityobject;")
+        token = cursor.fetchone()
+    con.rollback()
+    return str(token)
+
+def cacheEntry(cache_root, database, sql, params, token):
+    """Cache directory of one query on one database state"""
+    key = hashlib.sha1(repr((database, sql, params, token)).encode()).hexdigest()
+    return os.path.join(cache_root, key)
+
+def cacheRecords(records, directory):
+    """Pass records through while writing them to a cache entry, which is kept only once complete"""
+    temporary = directory + ".part"
+    os.makedirs(temporary, exist_ok=True)
+    complete = False
+    try:
+        with open(os.path.join(temporary, "coords.bin"), "wb") as coords, \
+             open(os.path.join(temporary, "totals.bin"), "wb") as totals, \
+             open(os.path.join(temporary, "counts.bin"), "wb") as counts, \
+             open(os.path.join(temporary, "attributes.jsonl"), "w") as attributes:
+            for record in records:
+                coords.write(np.ascontiguousarray(record["coords"], dtype=np.float64).tobytes())
+                totals.write(np.ascontiguousarray(record["totals"], dtype=np.int32).tobytes())
+                counts.write(np.array([len(record["coords"]), len(record["totals"])], dtype=np.int64).tobytes())
+                # one line per record, attributes are turned into strings on the objects anyway
+                attributes.write(json.dumps({key: record.get(key) for key in EXPORT_ATTRIBUTES + ("surface_gmlid",)},
+                                            default=str) + "\n")
+                yield record
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.replace(temporary, directory)
+        complete = True
+    finally:
+        if not complete:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+def mapArray(path, dtype):
+    """Memory-map a raw array file, empty files cannot be mapped"""
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+def cachedRecords(directory):
+    """Records of a cache entry, the geometry arrays are views on memory-mapped files"""
+    # the modification time orders the entries for eviction
+    os.utime(directory)
+    coords = mapArray(os.path.join(directory, "coords.bin"), np.float64).reshape(-1, 3)
+    totals = mapArray(os.path.join(directory, "totals.bin"), np.int32)
+    counts = np.fromfile(os.path.join(directory, "counts.bin"), dtype=np.int64).reshape(-1, 2)
+    ends = np.cumsum(counts, axis=0)
+    starts = ends - counts
+    with open(os.path.join(directory, "attributes.jsonl")) as attributes:
+        for line, (vertex_start, face_start), (vertex_end, face_end) in zip(attributes, starts, ends):
+            record = json.loads(line)
+            record["coords"] = coords[vertex_start:vertex_end]
+            record["totals"] = totals[face_start:face_end]
+            yield record
+
+def evictCache(cache_root, limit):
+    """Delete the least recently used cache entries until the cache fits in limit bytes"""
+    entries = []
+    for name in os.listdir(cache_root):
+        path = os.path.join(cache_root, name)
+        if os.path.isdir(path) and not name.endswith(".part"):
+            size = sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= limit:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+    return 0
+
+def fetchAll(con, sql, params=None):
+    """Fetch the whole query result as one batch"""
     with con.cursor(cursor_factory=RealDictCursor) as cursor:
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        con.close()
-    return rows
+        with timedStage("query"):
+            cursor.execute(sql, params)
+        with timedStage("fetch") as counter:
+            rows = cursor.fetchall()
+            counter["items"] = len(rows)
+    yield rows
+
+def importRecords(con, database, sql, itersize=None, cache_root=None, params=None):
+    """Decoded records of the import query, read from the disk cache while the database is unchanged"""
+    if itersize is None:
+        batches = fetchAll(con, sql, params)
+    else:
+        batches = fetchBatches(con, sql, itersize, params)
+    records = (record for rows in batches for record in decodeRows(rows))
+    if cache_root is None:
+        return records
+    directory = cacheEntry(cache_root, database, sql, params, changeToken(con))
+    # entries written before the attributes were stored per line are rebuilt
+    if os.path.isfile(os.path.join(directory, "attributes.jsonl")):
+        return cachedRecords(directory)
+    return cacheRecords(records, directory)
+
+def estimateRows(con, sql, params=None):
+    """Row count of a query as estimated by the planner, without running it"""
+    with con.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql.strip().rstrip(";"), params)
+        plan = cursor.fetchone()[0]
+    con.rollback()
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def offerBatch(batches, item, cancel):
+    """Queue an item for the main thread, waiting for room but not after a cancel"""
+    while not cancel.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def importWorker(credentials, sql, itersize, cache_root, batches, cancel, state):
+    """Run the import query in a worker thread and queue the decoded batches"""
+    try:
+        with pooledConnection(*credentials) as con:
+            state["pid"] = con.get_backend_pid()
+            state["srs"] = databaseSRS(con)
+            state["total"] = estimateRows(con, sql)
+            for records in batched(importRecords(con, credentials[:3], sql, itersize, cache_root), itersize):
+                if not offerBatch(batches, records, cancel):
+                    break
+    except Exception as error:
+        if not cancel.is_set():
+            state["error"] = str(error)
+    finally:
+        state["done"] = True
+    return 0
+
+def partitionRanges(con, parts):
+    """Building id ranges splitting citydb.building into parts of about equal size, None is unbounded"""
+    if parts < 2:
+        return [(None, None)]
+    # quantiles rather than an even split of min..max, ids are rarely evenly spread
+    with con.cursor() as cursor:
+        cursor.execute("SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY id) FROM citydb.building;",
+                       ([i / parts for i in range(1, parts)],))
+        bounds = cursor.fetchone()[0]
+    con.rollback()
+    bounds = sorted(set(bound for bound in bounds or () if bound is not None))
+    # the outer ranges are open so that rows of custom queries outside citydb.building are kept
+    edges = [None] + bounds + [None]
+    return list(zip(edges[:-1], edges[1:]))
+
+def rangeCondition(condition, params, low, high):
+    """Add a building id range to an optional import condition"""
+    conditions = [] if condition is None else ["({})".format(condition)]
+    params = list(params or ())
+    if low is not None:
+        conditions.append("q.building_id >= %s")
+        params.append(low)
+    if high is not None:
+        conditions.append("q.building_id < %s")
+        params.append(high)
+    return " AND ".join(conditions) or "TRUE", tuple(params)
+
+def partitionWorker(credentials, sql, params, itersize, batch_size, cache_root, batches, cancel, connections):
+    """Fetch and decode one partition of a parallel import, the queued batches end with None"""
+    try:
+        with pooledConnection(*credentials) as con:
+            # the query is cancelled when the import is abandoned, until the connection goes back to the pool
+            connections.add(con)
+            try:
+                # the import may have been abandoned before the connection was registered
+                if cancel.is_set():
+                    return 0
+                for records in batched(importRecords(con, credentials[:3], sql, itersize, cache_root, params),
+                                       batch_size):
+                    if not offerBatch(batches, records, cancel):
+                        return 0
+            finally:
+                connections.discard(con)
+    except Exception as error:
+        offerBatch(batches, error, cancel)
+    offerBatch(batches, None, cancel)
+    return 0
+
+def parallelRecords(credentials, sql, condition, params, itersize, batch_size, cache_root, workers):
+    """Records of the import query fetched over several connections, yielded in building id order"""
+    with pooledConnection(*credentials) as con:
+        ranges = partitionRanges(con, workers)
+    cancel = threading.Event()
+    connections = set()
+    # one bounded queue per partition keeps the order and lets the later partitions run ahead
+    queues = [queue.Queue(maxsize=ASYNC_QUEUE_SIZE) for _ in ranges]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+        try:
+            for (low, high), batches in zip(ranges, queues):
+                part_condition, part_params = rangeCondition(condition, params, low, high)
+                executor.submit(partitionWorker, credentials, filteredQuery(sql, part_condition), part_params,
+                                itersize, batch_size, cache_root, batches, cancel, connections)
+            for batches in queues:
+                while True:
+                    records = batches.get()
+                    if records is None:
+                        break
+                    if isinstance(records, Exception):
+                        raise records
+                    yield from records
+        finally:
+            # stop the workers when the import fails or is abandoned, the executor waits for their queries
+            cancel.set()
+            # cancelled on the workers' own connections, the pool may have none left to spare
+            for con in list(connections):
+                try:
+                    con.cancel()
+                except psycopg2.Error:
+                    pass
+
+def cancelImport(credentials, pid):
+    """Cancel the query running in another backend"""
+    with pooledConnection(*credentials) as con:
+        with con.cursor() as cursor:
+            cursor.execute("SELECT pg_cancel_backend(%s);", (pid,))
+    return 0
+
+def databaseSRS(con):
+    """SRID and WKT definition of the coordinates in the 3DCityDB, None for both without a citydb schema"""
+    with con.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('citydb.database_srs');")
+        if cursor.fetchone()[0] is None:
+            row = None
+        else:
+            cursor.execute("SELECT s.srid, r.srtext FROM citydb.database_srs AS s "
+                           "LEFT JOIN spatial_ref_sys AS r ON (r.srid = s.srid);")
+            row = cursor.fetchone()
+    con.rollback()
+    return (row[0], row[1]) if row is not None else (None, None)
+
+def databaseSRID(con):
+    """SRID of the coordinates in the 3DCityDB, None when the database has no citydb schema"""
+    return databaseSRS(con)[0]
+
+def storeSRS(scene, srid, definition):
+    """Keep the SRID of the imported data in the scene, and its definition for file export"""
+    if srid is not None:
+        scene["citydb_srid"] = srid
+        if definition:
+            scene["citydb_srs_wkt"] = definition
+    return 0
+
+def databaseOrigin(con):
+    """Whole metre point at the ground centre of all city objects, None for an empty database"""
+    with con.cursor() as cursor:
+        cursor.execute("SELECT ST_XMin(e), ST_XMax(e), ST_YMin(e), ST_YMax(e), ST_ZMin(e) "
+                       "FROM (SELECT ST_3DExtent(envelope) AS e FROM citydb.cityobject) AS extent;")
+        xmin, xmax, ymin, ymax, zmin = cursor.fetchone()
+    con.rollback()
+    if xmin is None:
+        return None
+    return np.floor([(xmin + xmax) / 2.0, (ymin + ymax) / 2.0, zmin]).tolist()
+
+def sceneOrigin(scene):
+    """Database coordinates of the scene origin, all zero before the first import"""
+    return np.array(scene.get("citydb_origin", (0.0, 0.0, 0.0))[:], dtype=np.float64)
+
+def shiftedRecords(records, scene):
+    """Move records to the scene origin, the first geometry sets the origin of a scene that has none"""
+    origin = None
+    for record in records:
+        if origin is None and "citydb_origin" not in scene.keys() and len(record["coords"]) > 0:
+            # projected coordinates are far too large for the float32 vertices, the origin is kept in doubles
+            scene["citydb_origin"] = np.floor(record["coords"].min(axis=0)).tolist()
+        if origin is None and "citydb_origin" in scene.keys():
+            origin = sceneOrigin(scene)
+        if origin is not None:
+            record["coords"] = record["coords"] - origin
+        yield record
+
+def prepareScene(scene, con):
+    """Store the SRID of the database and, unless the scene has one, an origin at the centre of its data"""
+    storeSRS(scene, *databaseSRS(con))
+    if "citydb_origin" not in scene.keys():
+        origin = databaseOrigin(con)
+        if origin is not None:
+            scene["citydb_origin"] = origin
+    return 0
 
-def createTable(con):
+def exportSRID(scene, con):
+    """SRID of the exported geometry, the one of the imported data or else the one of the target database"""
+    srid = scene.get("citydb_srid")
+    if srid is None:
+        srid = databaseSRID(con)
+    if srid is None:
+        raise ValueError("The coordinate system is unknown, import from a 3DCityDB first")
+    return int(srid)
+
+def createTable(con, srid):
     """Create table"""
     with con.cursor() as cursor:
         cursor.execute("CREATE TABLE IF NOT EXISTS blender_export ("
                        "id SERIAL PRIMARY KEY,"
+                       "export_key VARCHAR(32) UNIQUE,"
                        "building_id integer NOT NULL,"
                        "gmlid VARCHAR(128) NOT NULL,"
                        "height float,"
                        "year_of_construction date,"
                        "year_of_demolition date,"
-                       "geometry geometry(MultiPolygonZ,25833) NOT NULL,"
+                       "geometry geometry(MultiPolygonZ,{}) NOT NULL,"
                        "CONSTRAINT export_building_fk FOREIGN KEY (building_id) REFERENCES citydb.building (id)"
-                       ");")
+                       ");".format(int(srid)))
+        # tables created before the upsert export have no key column yet
+        cursor.execute("ALTER TABLE blender_export ADD COLUMN IF NOT EXISTS export_key VARCHAR(32) UNIQUE;")
         con.commit()
     return 0
 
-def insertIntoTable(con, building_id, gmlid, height, year_of_construction, year_of_demolition, wkt):
-    sql = ("INSERT INTO blender_export (building_id,gmlid,height,year_of_construction,year_of_demolition,geometry) "
-          "VALUES ('{}','{}','{}',to_date('{}','YYYY-MM-DD'),to_date('{}','YYYY-MM-DD'),ST_GeomFromText('{}'))"
-          .format(building_id,gmlid,height,year_of_construction,year_of_demolition,wkt))
-    sql = sql.replace("'None',", "null,")
-    with con.cursor() as cursor:
-        cursor.execute(sql)                       
+def copyValue(value):
+    """Format a value for the text format of COPY"""
+    if value is None or value == "None":
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+def copyRows(cursor, table, columns, rows, batch_size):
+    """Stream rows into a table with COPY, batch_size rows per COPY statement"""
+    sql = "COPY {} ({}) FROM STDIN".format(table, ",".join(columns))
+    for batch in batched(rows, batch_size):
+        buffer = io.StringIO()
+        for row in batch:
+            buffer.write("\t".join(copyValue(value) for value in row))
+            buffer.write("\n")
+        buffer.seek(0)
+        with timedStage("export_copy", len(batch)):
+            cursor.copy_expert(sql, buffer)
+    return 0
+
+def geometryHash(coords, totals, attributes):
+    """Hash face corner coordinates at millimetre precision together with the attributes"""
+    digest = hashlib.sha1(np.round(np.asarray(coords) * 1000.0).astype(np.int64).tobytes())
+    digest.update(np.asarray(totals, dtype=np.int32).tobytes())
+    digest.update(repr(attributes).encode())
+    return digest.hexdigest()
+
+def hashKey(obj, level=None):
+    """Property holding the hash of the exported state of an object at the level it shows or the given one"""
+    # every level of a LoD city building has its own state, showing another level is no edit
+    level = obj.get("citydb_level", "LOD1") if level is None else level
+    return "export_hash" if level == "LOD1" else "export_hash_" + level
+
+def objectAttributes(obj):
+    """Exported attributes of an object in a comparable form"""
+    return tuple(str(obj.get(key)) for key in EXPORT_ATTRIBUTES)
+
+def meshArrays(mesh):
+    """Read the face corner coordinates and the face sizes of a mesh with foreach_get"""
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    indices = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", indices)
+    starts = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_start", starts)
+    totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", totals)
+    # loops of every face in face order, whatever the order of the loop array is
+    offsets = np.repeat(starts - np.cumsum(totals) + totals, totals)
+    loops = offsets + np.arange(int(totals.sum()))
+    coords = co.reshape(-1, 3).astype(np.float64)[indices[loops]]
+    return coords, totals
+
+def worldArrays(obj, mesh=None):
+    """Face corner coordinates of an object in world space and its face sizes, of another mesh if given"""
+    coords, totals = meshArrays(obj.data if mesh is None else mesh)
+    matrix = np.array(obj.matrix_world, dtype=np.float64)
+    return coords @ matrix[:3, :3].T + matrix[:3, 3], totals
+
+def wkbMultiPolygon(coords, totals, srid=None):
+    """Encode faces as a MultiPolygonZ, EWKB with an SRID or else ISO WKB, every ring is closed with its first point"""
+    totals = np.asarray(totals, dtype=np.int64)
+    count = len(totals)
+    firsts = np.cumsum(totals) - totals
+    closed = np.insert(np.asarray(coords, dtype=np.float64), firsts + totals, coords[firsts], axis=0)
+    if srid is not None:
+        collection = struct.pack("<BIiI", 1, 0xA0000006, srid, count)
+    else:
+        collection = struct.pack("<BII", 1, 1006, count)
+    # Polygon Z header of every face: byte order, type, ring count, point count
+    headers = np.zeros(count, dtype=[("order", "u1"), ("type", "<u4"), ("rings", "<u4"), ("points", "<u4")])
+    headers["order"] = 1
+    headers["type"] = 0x80000003 if srid is not None else 1003
+    headers["rings"] = 1
+    headers["points"] = totals + 1
+    # mark the header bytes, everything in between is coordinate data in order
+    lead = len(collection)
+    sizes = 13 + 24 * (totals + 1)
+    offsets = lead + np.cumsum(sizes) - sizes
+    is_header = np.zeros(lead + int(sizes.sum()), dtype=bool)
+    is_header[:lead] = True
+    is_header[(offsets[:, None] + np.arange(13)).ravel()] = True
+    wkb = np.empty(len(is_header), dtype=np.uint8)
+    wkb[is_header] = np.concatenate((np.frombuffer(collection, dtype=np.uint8), headers.view(np.uint8)))
+    wkb[~is_header] = np.ascontiguousarray(closed, dtype="<f8").view(np.uint8).ravel()
+    return wkb.tobytes()
+
+def ewkbMultiPolygon(coords, totals, srid):
+    """Encode faces as a hex EWKB MultiPolygonZ for COPY"""
+    return wkbMultiPolygon(coords, totals, srid).hex()
+
+def exportableObjects(context):
+    """Mesh objects with faces that carry the 3DCityDB attributes"""
+    return [obj for obj in context.scene.objects
+            if obj.type == "MESH" and "building_id" in obj.keys() and len(obj.data.polygons) > 0]
+
+def exportRows(objects, exported, incremental, origin, srid):
+    """Yield one blender_export row per object whose hash changed, with one polygon per face"""
+    for obj in objects:
+        with timedStage("export_read", 1):
+            coords, totals = worldArrays(obj)
+            digest = geometryHash(coords, totals, objectAttributes(obj))
+        if incremental and digest == obj.get(hashKey(obj)):
+            continue
+        exported.append((obj, digest))
+        with timedStage("export_encode", 1):
+            # the hash is taken in scene coordinates, the database gets its own coordinates back
+            ewkb = ewkbMultiPolygon(coords + origin, totals, srid)
+        yield (obj["export_key"], obj["building_id"], obj["gmlid"], obj["height"],
+               obj["year_of_construction"], obj["year_of_demolition"], ewkb)
+
+def exportToDatabase(con, context, batch_size=10000, incremental=True, srid=None):
+    """Upsert changed mesh objects through COPY and delete the rows of removed objects"""
+    global _dirty_objects
+    if srid is None:
+        srid = exportSRID(context.scene, con)
+    origin = sceneOrigin(context.scene)
+    objects = exportableObjects(context)
+    keys = set()
+    candidates = []
+    for obj in objects:
+        key = obj.get("export_key")
+        # duplicated objects carry a copy of the key of their original
+        if key is None or key in keys:
+            key = obj["export_key"] = uuid.uuid4().hex
+            candidates.append(obj)
+        elif (not incremental or _dirty_objects is None or obj.name in _dirty_objects
+              or hashKey(obj) not in obj.keys()):
+            candidates.append(obj)
+        keys.add(key)
+    exported = []
+    columns = ("export_key",) + EXPORT_ATTRIBUTES + ("geometry",)
+    # only objects deleted by the user lose their rows, not those of unloaded tiles or earlier imports
+    removed = exportedKeys(context.scene) - keys
+    try:
+        with con.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE blender_export_stage ON COMMIT DROP AS "
+                           "SELECT {} FROM blender_export WITH NO DATA;".format(",".join(columns)))
+            copyRows(cursor, "blender_export_stage", columns,
+                     exportRows(candidates, exported, incremental, origin, srid), batch_size)
+            with timedStage("export_upsert", len(exported)):
+                cursor.execute("INSERT INTO blender_export ({0}) SELECT {0} FROM blender_export_stage "
+                               "ON CONFLICT (export_key) DO UPDATE SET {1};".format(
+                                   ",".join(columns),
+                                   ",".join("{0} = EXCLUDED.{0}".format(column) for column in columns[1:])))
+                cursor.execute("DELETE FROM blender_export WHERE export_key = ANY(%s);", (list(removed),))
+        with timedStage("export_commit"):
+            con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    # the database now holds the current state of the exported objects
+    for obj, digest in exported:
+        obj[hashKey(obj)] = digest
+    context.scene["citydb_exported_keys"] = " ".join(keys)
+    _dirty_objects = set()
+    return 0
+
+def fileValue(value):
+    """Attribute value of an object for file export, None where the database had NULL"""
+    return None if value is None or value == "None" else value
+
+def fileNumber(value):
+    """Attribute value as a number for file export, None where it is not one"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def objectsByGmlid(context):
+    """Exportable objects grouped by gmlid, the surfaces of one building become one city object"""
+    groups = collections.OrderedDict()
+    for obj in exportableObjects(context):
+        groups.setdefault(obj["gmlid"], []).append(obj)
+    return groups
+
+def cityObject(objects, boundaries):
+    """CityJSON Building of a group of objects with the attributes of the first"""
+    obj = objects[0]
+    attributes = {"building_id": obj["building_id"]}
+    height = fileNumber(obj.get("height"))
+    if height is not None:
+        attributes["measuredHeight"] = height
+    # dates in the database, years in CityJSON
+    for key, name in (("year_of_construction", "yearOfConstruction"), ("year_of_demolition", "yearOfDemolition")):
+        value = fileValue(obj.get(key))
+        if value is not None and str(value)[:4].isdigit():
+            attributes[name] = int(str(value)[:4])
+    lod = str(obj.get("citydb_level", "LOD2"))[-1]
+    return {"type": "Building", "attributes": attributes,
+            "geometry": [{"type": "MultiSurface", "lod": lod, "boundaries": boundaries}]}
+
+def writeCityJSON(path, context, srid):
+    """Stream the exportable objects to a CityJSON file with one quantised vertex list"""
+    origin = sceneOrigin(context.scene)
+    written = 0
+    # the vertex list follows the city objects, it is collected in a temporary file next to the output
+    with open(path, "w") as file, \
+         tempfile.TemporaryFile("w+", dir=os.path.dirname(os.path.abspath(path))) as vertices:
+        file.write('{"type":"CityJSON","version":"1.1","transform":')
+        json.dump({"scale": [CITYJSON_SCALE] * 3, "translate": origin.tolist()}, file)
+        file.write(',"metadata":')
+        json.dump({"referenceSystem": "https://www.opengis.net/def/crs/EPSG/0/{}".format(srid)}, file)
+        file.write(',"CityObjects":{')
+        for number, (gmlid, objects) in enumerate(objectsByGmlid(context).items()):
+            with timedStage("export_read", len(objects)):
+                arrays = [worldArrays(obj) for obj in objects]
+                coords = np.concatenate([coords for coords, _ in arrays])
+                totals = np.concatenate([totals for _, totals in arrays])
+            with timedStage("export_encode", 1):
+                # corners shared by the faces of a building are written once, sharing them across buildings
+                # would need an index of every vertex of the file in memory while it is streamed
+                unique, inverse = np.unique(np.round(coords / CITYJSON_SCALE).astype(np.int64), axis=0,
+                                            return_inverse=True)
+                indices = inverse.ravel() + written
+                faces = np.split(indices, np.cumsum(totals)[:-1])
+                boundaries = [[face.tolist()] for face in faces]
+                if written > 0 and len(unique) > 0:
+                    vertices.write(",")
+                vertices.write(",".join("[{},{},{}]".format(*vertex) for vertex in unique.tolist()))
+                written += len(unique)
+                file.write("," if number > 0 else "")
+                file.write(json.dumps(gmlid) + ":" + json.dumps(cityObject(objects, boundaries),
+                                                                 separators=(",", ":")))
+        file.write('},"vertices":[')
+        vertices.seek(0)
+        with timedStage("file_write"):
+            shutil.copyfileobj(vertices, file)
+        file.write("]}")
+    return written
+
+def gpkgGeometry(coords, totals, srid):
+    """GeoPackage geometry: header with byte order, SRID and 3D envelope, then ISO WKB"""
+    low = coords.min(axis=0)
+    high = coords.max(axis=0)
+    # flags: little endian header with an xyz envelope
+    header = struct.pack("<2sBBi6d", b"GP", 0, 0b101, srid, low[0], high[0], low[1], high[1], low[2], high[2])
+    return header + wkbMultiPolygon(coords, totals)
+
+def gpkgRows(objects, origin, srid, bounds):
+    """Rows of the buildings table, bounds are widened to the written geometry"""
+    for obj in objects:
+        with timedStage("export_read", 1):
+            coords, totals = worldArrays(obj)
+            coords = coords + origin
+        with timedStage("export_encode", 1):
+            geometry = gpkgGeometry(coords, totals, srid)
+        bounds[0] = np.minimum(bounds[0], coords[:, :2].min(axis=0))
+        bounds[1] = np.maximum(bounds[1], coords[:, :2].max(axis=0))
+        yield (sqlite3.Binary(geometry), obj["building_id"], obj["gmlid"], fileNumber(obj.get("height")),
+               fileValue(obj.get("year_of_construction")), fileValue(obj.get("year_of_demolition")))
+
+def writeGeoPackage(path, context, srid, batch_size=10000):
+    """Write the exportable objects to the buildings table of a new GeoPackage"""
+    if os.path.exists(path):
+        os.remove(path)
+    con = sqlite3.connect(path)
+    try:
+        con.execute("PRAGMA application_id = {};".format(GPKG_APPLICATION_ID))
+        con.execute("PRAGMA user_version = {};".format(GPKG_USER_VERSION))
+        con.executescript(GPKG_SCHEMA)
+        # the definition of the target SRS comes from spatial_ref_sys of the database at import
+        systems = [("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+                   ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+                   ("WGS 84 geodetic", 4326, "EPSG", 4326, GPKG_WGS84_WKT, "longitude/latitude coordinates in "
+                    "decimal degrees on the WGS 84 spheroid")]
+        if srid != 4326:
+            systems.append(("EPSG:{}".format(srid), srid, "EPSG", srid,
+                            context.scene.get("citydb_srs_wkt", "undefined"), None))
+        con.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?);", systems)
+        bounds = [np.full(2, np.inf), np.full(2, -np.inf)]
+        written = 0
+        rows = gpkgRows(exportableObjects(context), sceneOrigin(context.scene), srid, bounds)
+        for batch in batched(rows, batch_size):
+            with timedStage("file_write", len(batch)):
+                con.executemany("INSERT INTO buildings (geom, building_id, gmlid, height, year_of_construction, "
+                                "year_of_demolition) VALUES (?, ?, ?, ?, ?, ?);", batch)
+            written += len(batch)
+        extent = [None] * 4 if written == 0 else bounds[0].tolist() + bounds[1].tolist()
+        con.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, max_y, "
+                    "srs_id) VALUES ('buildings', 'features', 'buildings', ?, ?, ?, ?, ?);", extent + [srid])
+        con.execute("INSERT INTO gpkg_geometry_columns VALUES ('buildings', 'geom', 'MULTIPOLYGON', ?, 1, 0);",
+                    (srid,))
         con.commit()
+    finally:
+        con.close()
+    return written
+
+@persistent
+def trackChanges(scene, depsgraph=None):
+    """Remember the objects touched by a depsgraph update since the last export, forget edited shared meshes"""
+    if depsgraph is None:
+        return
+    for update in depsgraph.updates:
+        if not isinstance(update.id, bpy.types.Object):
+            continue
+        obj = update.id.original
+        if _dirty_objects is not None:
+            _dirty_objects.add(obj.name)
+        # a shared mesh edited in edit or sculpt mode must not be attached to buildings imported later
+        if update.is_updated_geometry and obj.mode != "OBJECT" and obj.data is not None:
+            shape = obj.data.get("citydb_shape")
+            if shape is not None and _shared_meshes.get(shape) == obj.data.name:
+                del _shared_meshes[shape]
+
+@persistent
+def resetChanges(*args):
+    """Changes made before a file was loaded are unknown, compare all objects on the next export"""
+    global _dirty_objects
+    _dirty_objects = None
+
+def resetHashes(obj):
+    """Take the current attributes and the meshes of every level as the exported state of an object"""
+    shown = obj.get("citydb_level", "LOD1")
+    levels = {shown} | {key[len("export_hash_"):] for key in obj.keys() if key.startswith("export_hash_")}
+    if "export_hash" in obj.keys():
+        levels.add("LOD1")
+    for level in levels:
+        if level == shown:
+            mesh = obj.data
+        elif level == "LOD1":
+            mesh = bpy.data.meshes.get(obj.get("citydb_lod1_mesh", ""))
+        else:
+            mesh = bpy.data.meshes.get(_detail_meshes.get((obj.get("building_id"), level), ""))
+        key = hashKey(obj, level)
+        if mesh is not None:
+            coords, totals = worldArrays(obj, mesh)
+            obj[key] = geometryHash(coords, totals, objectAttributes(obj))
+        elif key in obj.keys():
+            # hashed again when the detailed mesh is fetched the next time
+            del obj[key]
     return 0
 
-def exportToDatabase(con, context):
-    for obj in context.scene.objects:
-        if obj.type == "MESH":
-            building_id = obj["building_id"]
-            gmlid = obj["gmlid"]
-            height = obj["height"]
-            year_of_construction = obj["year_of_construction"]
-            year_of_demolition = obj["year_of_demolition"]
-            # get coordinates of object
-            coords = [v.co for v in obj.data.vertices]
-            # coordinate arrays to tuples
-            plain_v = [v.to_tuple() for v in coords]
-            # coordinate tuples to WKT
-            wkt = ("MultiPolygon Z (((" + ",".join(" ".join(str(i) for i in tuple) for tuple in plain_v) + 
-            ","  + " ".join(str(i) for i in list(plain_v[0])) + ")))")
-            insertIntoTable(con, building_id, gmlid, height, year_of_construction, year_of_demolition, wkt)
+def storedKeys(con, keys):
+    """Export keys among the given ones that already have a row in blender_export"""
+    with con.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('blender_export');")
+        if cursor.fetchone()[0] is None:
+            rows = []
+        else:
+            cursor.execute("SELECT export_key FROM blender_export WHERE export_key = ANY(%s);", (list(keys),))
+            rows = cursor.fetchall()
+    con.rollback()
+    return set(row[0] for row in rows)
+
+def refreshAttributes(con, scene):
+    """Update the attribute properties of the scene objects from citydb.building, the meshes stay as they are"""
+    buildings = {}
+    for obj in scene.objects:
+        if "building_id" in obj.keys():
+            buildings.setdefault(obj["building_id"], []).append(obj)
+    if not buildings:
+        return 0
+    with timedStage("query"):
+        rows = next(fetchAll(con, ATTRIBUTE_SQL, (list(buildings),)))
+        stored = storedKeys(con, [obj["export_key"] for objects in buildings.values() for obj in objects
+                                  if "export_key" in obj.keys()])
+    updated = 0
+    with timedStage("refresh") as counter:
+        for row in rows:
+            # stored as strings like on import, except the gmlid
+            values = {"gmlid": row["gmlid"], "height": str(row["height"]),
+                      "year_of_construction": str(row["year_of_construction"]),
+                      "year_of_demolition": str(row["year_of_demolition"])}
+            for obj in buildings.get(row["building_id"], ()):
+                if all(obj.get(key) == value for key, value in values.items()):
+                    continue
+                # a row in blender_export keeps the old attributes until the next export writes it
+                pending = obj.get("export_key") in stored
+                if not pending:
+                    # edits not exported yet have to stay visible to the next export
+                    coords, totals = worldArrays(obj)
+                    pending = geometryHash(coords, totals, objectAttributes(obj)) != obj.get(hashKey(obj))
+                for key, value in values.items():
+                    obj[key] = value
+                if not pending:
+                    resetHashes(obj)
+                elif _dirty_objects is not None:
+                    # property changes from Python are not seen by the depsgraph handler
+                    _dirty_objects.add(obj.name)
+                updated += 1
+        counter["items"] = updated
+    if updated:
+        markChanged(scene)
+    return updated
+
+def removeObject(obj):
+    """Delete an object and its mesh once nothing else uses the mesh"""
+    mesh = obj.data
+    bpy.data.objects.remove(obj)
+    if mesh is not None and mesh.users == 0:
+        bpy.data.meshes.remove(mesh)
+    return 0
+
+def copyProperties(source, target):
+    """Copy the custom properties of an object except the export bookkeeping"""
+    for key in source.keys():
+        if key not in ("_RNA_UI", "export_key") and not key.startswith("export_hash"):
+            target[key] = source[key]
     return 0
 
 def mergeSurfaces(context):
-    name = []
-    # deselect all the objects
-    bpy.ops.object.select_all(action="DESELECT")
-    # loop to record different gmlid
+    """Merge the surfaces of every building into one mesh, grouped by the gmlid property"""
+    buildings = {}
     for obj in context.scene.objects:
-        if obj.name.split(".")[0] not in name:
-            name.append(obj.name.split(".")[0])
-    # merge surfaces of each building by gmlid
-    for id in name:
-        for obj in context.scene.objects:
-            # select the object with the name(gmlid)
-            if obj.name.startswith(id):
-                obj.name = id
-                obj.select_set(True)
-                context.view_layer.objects.active = obj
-            else:
-                obj.select_set(False)
-        # merge surfaces
-        bpy.ops.object.join()
+        if obj.type == "MESH" and "gmlid" in obj.keys():
+            buildings.setdefault(obj["gmlid"], []).append(obj)
+    for gmlid, surfaces in buildings.items():
+        if len(surfaces) < 2:
+            continue
+        with timedStage("merge_read", len(surfaces)):
+            arrays = [worldArrays(obj) for obj in surfaces]
+        new_mesh = buildMesh(gmlid, np.concatenate([coords for coords, _ in arrays]),
+                             np.concatenate([totals for _, totals in arrays]))
+        with timedStage("link", 1):
+            new_object = bpy.data.objects.new(gmlid, new_mesh)
+            copyProperties(surfaces[0], new_object)
+            for collection in surfaces[0].users_collection:
+                collection.objects.link(new_object)
+        with timedStage("merge_remove", len(surfaces)):
+            for obj in surfaces:
+                removeObject(obj)
+        # Blender appended a number while a surface still had the name
+        new_object.name = gmlid
+    return 0
 
 def separateSurfaces(context):
-    for obj in context.scene.objects:
-        if obj.type == 'MESH' and len(obj.data.polygons) > 1:
-            obj.select_set(True)
-            # Enter edit mode
-            bpy.ops.object.mode_set(mode='EDIT')
-            # Select all faces
-            bpy.ops.mesh.select_all(action='SELECT')
-            # Separate the faces into individual objects
-            bpy.ops.mesh.separate(type='LOOSE')
-            # Exit edit mode
-            bpy.ops.object.mode_set(mode='OBJECT')
+    """Split every object with several faces into one object per face"""
+    buildings = [obj for obj in context.scene.objects if obj.type == 'MESH' and len(obj.data.polygons) > 1]
+    for obj in buildings:
+        coords, totals = worldArrays(obj)
+        ends = np.cumsum(totals)
+        name = obj.get("gmlid", obj.name)
+        for face, end in enumerate(ends):
+            new_mesh = buildMesh(name, coords[end - totals[face]:end], totals[face:face + 1])
+            new_object = bpy.data.objects.new(name, new_mesh)
+            copyProperties(obj, new_object)
+            for collection in obj.users_collection:
+                collection.objects.link(new_object)
+        removeObject(obj)
+    return 0
           
-def geojsonParser(rows, context):
-    """Convert GeoJSON coordinates to Blender Objects"""
-    # convert geojson of one row to dictionary
-    for row in rows:
-        vertices = []
-        edges = []
-        face = []
-        faces = []
-#        geometry = None
-#        surface_gmlid = None
-#        building_id = None
-#        year_of_construction = None
-#        year_of_demolition = None
-#        height = None
-#        id = None
-        if "geometry" in row:
-            geometry = row["geometry"]
-#        if "surface_gmlid" in row:
-#            surface_gmlid = row["surface_gmlid"]
-        if "building_id" in row:
-            building_id = row["building_id"]
-        if "year_of_construction" in row:
-            year_of_construction = row["year_of_construction"]
-        if "year_of_demolition" in row:
-            year_of_demolition = row["year_of_demolition"]
-        if "height" in row:
-            height = row["height"]
-        if "gmlid" in row:
-            id = row["gmlid"]
-        if geometry is not None:
-            geometry = json.loads(geometry)
-            if geometry["type"] == "Polygon":
-                for array in geometry["coordinates"]:
-                    for point in array:
-                        vertices.append(tuple(point))
-                # delete the repeating coordinates
-                vertices.pop(len(vertices)-1)
-                # append vertices tuple in faces
-                for i in range(int(len(vertices))):
-                    face.append(i)
-                faces.append(tuple(face))
-            if geometry['type'] == "MultiPolygon":
-                for arrays in geometry["coordinates"]:
-                    for array in arrays:
-                        for point in array:
-                            vertices.append(tuple(point))
-                # delete the repeating coordinates
-                vertices.append(tuple(point))
-                # append vertices tuple in faces
-                for i in range(int(len(vertices))):
-                    face.append(i)
-                faces.append(tuple(face))                
-        # generate object in blender
-        new_mesh = bpy.data.meshes.new(id)
-        new_mesh.from_pydata(vertices, edges, faces)
-        new_mesh.update()
+def parseGeoJSON(geometry):
+    """Convert a GeoJSON Polygon/MultiPolygon to a coordinate array and the vertex count of each face"""
+    geometry = json.loads(geometry)
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        polygons = []
+    # the exterior ring of every polygon becomes one face, without the repeating closing point
+    rings = [np.asarray(polygon[0][:-1], dtype=np.float64) for polygon in polygons if polygon and len(polygon[0]) > 3]
+    if not rings:
+        return np.zeros((0, 3), dtype=np.float64), np.zeros(0, dtype=np.int32)
+    points = np.concatenate(rings)
+    coords = np.zeros((len(points), 3), dtype=np.float64)
+    coords[:, :min(points.shape[1], 3)] = points[:, :3]
+    totals = np.array([len(ring) for ring in rings], dtype=np.int32)
+    return coords, totals
+
+def readWKB(buffer, offset, rings):
+    """Read one (E)WKB geometry at offset, append the exterior ring views and return the end offset"""
+    order = "<" if buffer[offset] == 1 else ">"
+    geometry_type, = struct.unpack_from(order + "I", buffer, offset + 1)
+    offset += 5
+    # EWKB flags for SRID, Z and M
+    if geometry_type & 0x20000000:
+        offset += 4
+    has_z = bool(geometry_type & 0x80000000)
+    has_m = bool(geometry_type & 0x40000000)
+    geometry_type &= 0x0FFFFFFF
+    # ISO WKB adds 1000 for Z, 2000 for M and 3000 for ZM
+    has_z = has_z or geometry_type // 1000 in (1, 3)
+    has_m = has_m or geometry_type // 1000 in (2, 3)
+    geometry_type %= 1000
+    dims = 2 + has_z + has_m
+    if geometry_type == 3:
+        ring_count, = struct.unpack_from(order + "I", buffer, offset)
+        offset += 4
+        for ring in range(ring_count):
+            point_count, = struct.unpack_from(order + "I", buffer, offset)
+            offset += 4
+            # a view on the received bytes, nothing is copied here
+            points = np.frombuffer(buffer, dtype=np.dtype(order + "f8"), count=point_count * dims,
+                                   offset=offset).reshape(point_count, dims)
+            offset += point_count * dims * 8
+            # the exterior ring becomes one face, without the repeating closing point
+            if ring == 0 and point_count > 3:
+                rings.append((points[:-1], has_z))
+    elif geometry_type in (6, 7):
+        count, = struct.unpack_from(order + "I", buffer, offset)
+        offset += 4
+        for _ in range(count):
+            offset = readWKB(buffer, offset, rings)
+    else:
+        raise ValueError("Unsupported WKB geometry type {}".format(geometry_type))
+    return offset
+
+def parseWKB(geometry):
+    """Convert a WKB Polygon/MultiPolygon to a coordinate array and the vertex count of each face"""
+    rings = []
+    readWKB(memoryview(geometry), 0, rings)
+    if not rings:
+        return np.zeros((0, 3), dtype=np.float64), np.zeros(0, dtype=np.int32)
+    totals = np.array([len(points) for points, _ in rings], dtype=np.int32)
+    coords = np.zeros((int(totals.sum()), 3), dtype=np.float64)
+    start = 0
+    for points, has_z in rings:
+        coords[start:start + len(points), :2] = points[:, :2]
+        if has_z:
+            coords[start:start + len(points), 2] = points[:, 2]
+        start += len(points)
+    return coords, totals
+
+def parseGeometry(geometry):
+    """Decode binary WKB, hex encoded (E)WKB or GeoJSON text"""
+    if isinstance(geometry, (bytes, bytearray, memoryview)):
+        return parseWKB(geometry)
+    if geometry.lstrip().startswith("{"):
+        return parseGeoJSON(geometry)
+    return parseWKB(bytes.fromhex(geometry))
+
+def decodeRows(rows):
+    """Convert fetched rows to records holding the attributes and the geometry arrays"""
+    # timed per row but recorded once per batch, rows are decoded lazily between other stages
+    seconds = 0.0
+    decoded = 0
+    try:
+        for row in rows:
+            start = time.perf_counter()
+            geometry = row.get("geometry")
+            if geometry is not None:
+                coords, totals = parseGeometry(geometry)
+            else:
+                coords, totals = np.zeros((0, 3), dtype=np.float64), np.zeros(0, dtype=np.int32)
+            seconds += time.perf_counter() - start
+            decoded += 1
+            yield {
+                "building_id": row.get("building_id"),
+                "gmlid": row.get("gmlid"),
+                "surface_gmlid": row.get("surface_gmlid"),
+                "height": row.get("height"),
+                "year_of_construction": row.get("year_of_construction"),
+                "year_of_demolition": row.get("year_of_demolition"),
+                "coords": coords,
+                "totals": totals,
+            }
+    finally:
+        recordStage("decode", seconds, decoded, calls=1 if decoded else 0)
+
+def groupRecords(records, key):
+    """Concatenate the geometry of consecutive records with the same key"""
+    for _, group in itertools.groupby(records, key=key):
+        group = list(group)
+        record = dict(group[0])
+        if len(group) > 1:
+            record["coords"] = np.concatenate([r["coords"] for r in group])
+            record["totals"] = np.concatenate([r["totals"] for r in group])
+        yield record
+
+def buildMesh(name, coords, totals):
+    """Create a mesh from a coordinate array and face sizes with foreach_set"""
+    start = time.perf_counter()
+    mesh = bpy.data.meshes.new(name)
+    # every face owns its vertices, so the loops simply enumerate the vertices
+    starts = np.zeros(len(totals), dtype=np.int32)
+    np.cumsum(totals[:-1], out=starts[1:])
+    mesh.vertices.add(len(coords))
+    mesh.vertices.foreach_set("co", coords.astype(np.float32).ravel())
+    mesh.loops.add(len(coords))
+    mesh.loops.foreach_set("vertex_index", np.arange(len(coords), dtype=np.int32))
+    mesh.polygons.add(len(totals))
+    mesh.polygons.foreach_set("loop_start", starts)
+    # since Blender 4.0 the face sizes are derived from the loop starts
+    if bpy.app.version < (4, 0, 0):
+        mesh.polygons.foreach_set("loop_total", totals)
+    mesh.update(calc_edges=True)
+    recordStage("build", time.perf_counter() - start, len(coords))
+    return mesh
+
+def shapeHash(coords, totals):
+    """Hash face corner coordinates at millimetre precision together with the face sizes"""
+    digest = hashlib.sha1(np.round(np.asarray(coords) * 1000.0).astype(np.int64).tobytes())
+    digest.update(np.asarray(totals, dtype=np.int32).tobytes())
+    return digest.hexdigest()
+
+def sharedMesh(name, coords, totals):
+    """Mesh of a geometry moved to its own origin, reused for every copy of the geometry shifted in space"""
+    # the origin is what the float32 object location can hold, the rest stays in the vertices
+    if len(coords) > 0:
+        origin = coords.min(axis=0).astype(np.float32)
+    else:
+        origin = np.zeros(3, dtype=np.float32)
+    local = coords - origin
+    key = shapeHash(local, totals)
+    mesh = bpy.data.meshes.get(_shared_meshes.get(key, ""))
+    if mesh is not None and mesh.get("citydb_shape") == key:
+        recordStage("reuse", 0.0, 1)
+    else:
+        mesh = buildMesh(name, local, totals)
+        mesh["citydb_shape"] = key
+        _shared_meshes[key] = mesh.name
+    return mesh, origin, local
+
+def exportKey(grouping, record, ordinal):
+    """Export key of an imported object taken from its gmlids, so that a re-import updates the same row"""
+    # queries without surface gmlids fall back to the position of the surface in its building
+    surface = record.get("surface_gmlid") if grouping == "SURFACE" else None
+    identity = (grouping, record["gmlid"], ordinal if surface is None else surface)
+    return hashlib.md5(repr(identity).encode()).hexdigest()
+
+def buildObjects(records, collection, grouping="SURFACE", tile_name="Tile", instancing=False):
+    """Create one Blender object per record, per building or per tile depending on grouping"""
+    if grouping == "BUILDING":
+        records = groupRecords(records, lambda record: record["building_id"])
+    elif grouping == "TILE":
+        records = groupRecords(records, lambda record: tile_name)
+    # a tile mesh is never repeated
+    instancing = instancing and grouping != "TILE"
+    building_id, ordinal = None, 0
+    for record in records:
+        ordinal = ordinal + 1 if record["building_id"] == building_id else 0
+        building_id = record["building_id"]
+        id = record["gmlid"] if grouping != "TILE" else tile_name
+        if instancing:
+            new_mesh, origin, local = sharedMesh(id, record["coords"], record["totals"])
+            # the coordinates the exporter will read back, local vertices and location are float32
+            world = local.astype(np.float32).astype(np.float64) + origin
+        else:
+            new_mesh = buildMesh(id, record["coords"], record["totals"])
+            world = record["coords"].astype(np.float32).astype(np.float64)
+        start = time.perf_counter()
         new_object = bpy.data.objects.new(id, new_mesh)
+        if instancing:
+            new_object.location = origin
+        collection.objects.link(new_object)
+        # a tile mesh holds many buildings, the attributes of one of them would be misleading
+        if grouping == "TILE":
+            recordStage("link", time.perf_counter() - start, 1)
+            continue
         # add height, gmlid, year_of_construction,year_of_demolition as object properties
-        new_object["height"] = str(height)
-#        new_object["surface_gmlid"] = surface_gmlid
+        new_object["height"] = str(record["height"])
         new_object["gmlid"] = id
-        new_object["building_id"] = building_id
-        new_object["year_of_construction"] = str(year_of_construction)
-        new_object["year_of_demolition"] = str(year_of_demolition)
-        context.collection.objects.link(new_object)
+        new_object["building_id"] = record["building_id"]
+        new_object["year_of_construction"] = str(record["year_of_construction"])
+        new_object["year_of_demolition"] = str(record["year_of_demolition"])
+        # record the imported state so that only later edits are exported
+        new_object["export_key"] = exportKey(grouping, record, ordinal)
+        new_object["export_hash"] = geometryHash(world, record["totals"], objectAttributes(new_object))
+        recordStage("link", time.perf_counter() - start, 1)
+
+def geojsonParser(rows, context, grouping="SURFACE", instancing=False):
+    """Convert GeoJSON or WKB coordinates to Blender Objects"""
+    buildObjects(shiftedRecords(decodeRows(rows), context.scene), context.collection, grouping,
+                 instancing=instancing)
+
+def filteredQuery(sql, condition):
+    """Restrict the rows of the import query by a condition on its building_id column"""
+    # the user query is used as a subquery, literal % signs must not be taken as parameters
+    return "SELECT * FROM ({}) AS q WHERE {} ORDER BY q.building_id".format(
+        sql.strip().rstrip(";").replace("%", "%%"), condition)
+
+def importScene(scene, collection, condition=None, params=None):
+    """Import the rows of the import query, only those of the matching buildings when a condition is given"""
+    props = scene.MyProperties
+    cache_root = cacheDirectory() if props.use_cache else None
+    itersize = props.itersize if props.streaming else None
+    # meshes of earlier imports may have been edited or left without users by clearAll
+    _shared_meshes.clear()
+    if props.parallel_workers > 1:
+        # partitions are fetched and decoded in worker threads, meshes are built here on the main thread
+        with pooledConnection(props.host, props.name, props.user, props.password) as con:
+            srs = databaseSRS(con)
+        records = parallelRecords((props.host, props.name, props.user, props.password), props.sql, condition,
+                                  params, itersize, props.itersize, cache_root, props.parallel_workers)
+        buildObjects(shiftedRecords(records, scene), collection, props.grouping, instancing=props.instancing)
+    else:
+        sql = props.sql if condition is None else filteredQuery(props.sql, condition)
+        with pooledConnection(props.host, props.name, props.user, props.password) as con:
+            srs = databaseSRS(con)
+            # rows are converted to blender objects batch by batch while they are fetched
+            records = importRecords(con, (props.host, props.name, props.user), sql, itersize, cache_root, params)
+            # convert GeoJSON/WKB data to blender objects
+            buildObjects(shiftedRecords(records, scene), collection, props.grouping, instancing=props.instancing)
+    storeSRS(scene, *srs)
+    markChanged(scene)
+    if cache_root is not None:
+        evictCache(cache_root, props.cache_size * 1024 * 1024)
+    return 0
+
+def tileQuery(sql):
+    """Import query restricted to the buildings whose envelope centre lies in one tile"""
+    return filteredQuery(sql, (
+        "q.building_id IN (SELECT co.id FROM citydb.cityobject AS co "
+        "WHERE co.envelope && ST_MakeEnvelope(%s, %s, %s, %s, (SELECT srid FROM citydb.database_srs)) "
+        "AND ST_X(ST_Centroid(co.envelope)) >= %s AND ST_X(ST_Centroid(co.envelope)) < %s "
+        "AND ST_Y(ST_Centroid(co.envelope)) >= %s AND ST_Y(ST_Centroid(co.envelope)) < %s)"))
+
+def findRegion3D():
+    """The view of the first 3D viewport found in the open windows"""
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == "VIEW_3D":
+                return area.spaces.active.region_3d
+    return None
+
+def visibleBounds(scene, source):
+    """XY bounds of the ground seen by the 3D viewport or the active camera"""
+    if source == "VIEWPORT":
+        region_3d = findRegion3D()
+        if region_3d is not None:
+            center = region_3d.view_location
+            distance = region_3d.view_distance
+            return (center.x - distance, center.y - distance, center.x + distance, center.y + distance)
+    camera = scene.camera
+    if camera is None:
+        return None
+    # corners of the frustum at the far clipping distance
+    matrix = np.array(camera.matrix_world)
+    corners = np.array([corner.to_tuple() for corner in camera.data.view_frame(scene=scene)])
+    corners *= camera.data.clip_end / np.abs(corners[:, 2:3])
+    points = np.vstack((corners @ matrix[:3, :3].T + matrix[:3, 3], matrix[:3, 3]))
+    return (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+
+def tilesInBounds(bounds, size):
+    """Grid cells of the given size intersecting the bounds, nearest to the centre first"""
+    xmin, ymin, xmax, ymax = bounds
+    tiles = [(i, j) for i in range(int(np.floor(xmin / size)), int(np.floor(xmax / size)) + 1)
+             for j in range(int(np.floor(ymin / size)), int(np.floor(ymax / size)) + 1)]
+    center = ((xmin + xmax) / 2.0 / size - 0.5, (ymin + ymax) / 2.0 / size - 0.5)
+    tiles.sort(key=lambda tile: (tile[0] - center[0]) ** 2 + (tile[1] - center[1]) ** 2)
+    return [(i, j, size) for i, j in tiles]
+
+def tileBytes(collection):
+    """Rough memory estimate of the meshes of a tile, shared meshes are counted once"""
+    meshes = {obj.data.name: obj.data for obj in collection.objects if obj.type == "MESH"}
+    return sum(len(mesh.vertices) * MESH_BYTES_PER_VERTEX + len(mesh.polygons) * MESH_BYTES_PER_FACE
+               for mesh in meshes.values())
+
+def unloadTile(tile):
+    """Remove the objects, meshes and collection of a loaded tile"""
+    collection = bpy.data.collections.get(_tiles.pop(tile)["collection"])
+    if collection is not None:
+        removeTile(collection)
+    return 0
+
+def removeTile(collection):
+    """Remove the objects, meshes and collection of a tile, its blender_export rows are kept"""
+    releaseObjects(bpy.context.scene, collection.objects)
+    for obj in list(collection.objects):
+        mesh = obj.data
+        bpy.data.objects.remove(obj)
+        if mesh is not None and mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
+    bpy.data.collections.remove(collection)
+    return 0
+
+def loadTile(scene, tile, props):
+    """Fetch the buildings of one tile into a collection of their own"""
+    i, j, size = tile
+    xmin, ymin, xmax, ymax = i * size, j * size, (i + 1) * size, (j + 1) * size
+    collection = bpy.data.collections.new("Tile {}_{}".format(i, j))
+    collection["citydb_tile"] = [i, j]
+    collection["citydb_tile_size"] = size
+    scene.collection.children.link(collection)
+    params = (xmin, ymin, xmax, ymax, xmin, xmax, ymin, ymax)
+    rows = itertools.chain.from_iterable(streamDatabase(props.host, props.name, props.user, props.password,
+                                                        tileQuery(props.sql), props.itersize, params))
+    buildObjects(shiftedRecords(decodeRows(rows), scene), collection, props.grouping, collection.name,
+                 props.instancing)
+    _tiles[tile] = {"collection": collection.name, "bytes": tileBytes(collection)}
+    return collection
+
+def loadVisibleTiles(scene):
+    """Load the tiles in view and unload the least recently seen ones beyond the memory budget"""
+    props = scene.MyProperties
+    # tiles deleted by the user or loaded in an earlier session
+    for tile in [tile for tile in _tiles if _tiles[tile]["collection"] not in bpy.data.collections]:
+        del _tiles[tile]
+    for collection in bpy.data.collections:
+        if "citydb_tile" in collection.keys():
+            tile = tuple(collection["citydb_tile"]) + (collection["citydb_tile_size"],)
+            if tile not in _tiles:
+                _tiles[tile] = {"collection": collection.name, "bytes": tileBytes(collection)}
+                _tiles.move_to_end(tile, last=False)
+    # the view is centred on the data before anything is loaded
+    if "citydb_origin" not in scene.keys() or "citydb_srid" not in scene.keys():
+        with pooledConnection(props.host, props.name, props.user, props.password) as con:
+            prepareScene(scene, con)
+    bounds = visibleBounds(scene, props.tile_source)
+    if bounds is None:
+        return 0
+    # tiles are cut in database coordinates
+    x, y, _ = sceneOrigin(scene)
+    bounds = (bounds[0] + x, bounds[1] + y, bounds[2] + x, bounds[3] + y)
+    budget = props.tile_budget * 1024 * 1024
+    visible = tilesInBounds(bounds, props.tile_size)[:MAX_VISIBLE_TILES]
+    loaded = 0
+    for tile in visible:
+        if tile in _tiles:
+            _tiles.move_to_end(tile)
+        elif sum(entry["bytes"] for entry in _tiles.values()) < budget:
+            loadTile(scene, tile, props)
+            loaded += 1
+    # least recently seen tiles first, tiles in view are never unloaded
+    for tile in list(_tiles):
+        if sum(entry["bytes"] for entry in _tiles.values()) <= budget:
+            break
+        if tile not in visible:
+            unloadTile(tile)
+    return loaded
+
+def followView():
+    """Timer callback loading the tiles in view while Follow View is enabled"""
+    scene = bpy.context.scene
+    if scene is None or not scene.MyProperties.tile_follow_view:
+        return None
+    loadVisibleTiles(scene)
+    return TILE_FOLLOW_INTERVAL
+
+def toggleFollowView(self, context):
+    """Start or stop the timer of Follow View"""
+    if self.tile_follow_view and not bpy.app.timers.is_registered(followView):
+        bpy.app.timers.register(followView)
+    elif not self.tile_follow_view and bpy.app.timers.is_registered(followView):
+        bpy.app.timers.unregister(followView)
+
+def extrudeFootprint(coords, totals, height):
+    """Prism of the footprint faces: ground face, roof face and one quad wall per footprint edge"""
+    totals = np.asarray(totals, dtype=np.int64)
+    starts = np.repeat(np.cumsum(totals) - totals, totals)
+    ends = starts + np.repeat(totals, totals)
+    index = np.arange(len(coords))
+    following = index + 1
+    following[following == ends] = starts[following == ends]
+    roof = coords + (0.0, 0.0, height)
+    # the ground is reversed to face down, walls run along the counter-clockwise footprint to face out
+    ground = coords[starts + ends - 1 - index]
+    walls = np.stack((coords, coords[following], roof[following], roof), axis=1).reshape(-1, 3)
+    return (np.concatenate((ground, roof, walls)),
+            np.concatenate((totals, totals, np.full(len(coords), 4, dtype=np.int64))).astype(np.int32))
+
+def lod1Records(rows):
+    """Records of LoD1 rows, footprints are extruded where the building has no LoD1 solid"""
+    for row, record in zip(rows, decodeRows(rows)):
+        if len(record["totals"]) == 0 and row.get("footprint") is not None and row.get("height") is not None:
+            coords, totals = parseGeometry(row["footprint"])
+            record["coords"], record["totals"] = extrudeFootprint(coords, totals, float(row["height"]))
+        yield record
+
+def rememberCenters(records, centers):
+    """Pass records through while noting the centre of every building"""
+    for record in records:
+        if len(record["coords"]) > 0:
+            centers[record["building_id"]] = record["coords"].mean(axis=0).tolist()
+        yield record
+
+def loadLodCity(scene, props):
+    """Import every building at LoD1 into a collection whose objects switch level with the view distance"""
+    collection = bpy.data.collections.new("LoD City")
+    collection["citydb_lod"] = True
+    scene.collection.children.link(collection)
+    centers = {}
+    with pooledConnection(props.host, props.name, props.user, props.password) as con:
+        prepareScene(scene, con)
+        records = (record for rows in fetchBatches(con, LOD1_SQL, props.itersize) for record in lod1Records(rows))
+        buildObjects(rememberCenters(shiftedRecords(records, scene), centers), collection, "SURFACE")
+    for obj in collection.objects:
+        obj["citydb_center"] = centers.get(obj["building_id"], (0.0, 0.0, 0.0))
+        obj["citydb_level"] = "LOD1"
+        obj["citydb_lod1_mesh"] = obj.data.name
+        # a mesh that is swapped out must survive until it is swapped back in
+        obj.data.use_fake_user = True
+        _lod1_meshes.add(obj.data.name)
+    return collection
+
+def viewPoint(scene, source):
+    """Eye position of the 3D viewport or the active camera"""
+    if source == "VIEWPORT":
+        region_3d = findRegion3D()
+        if region_3d is not None:
+            return np.array(region_3d.view_matrix.inverted().translation, dtype=np.float64)
+    if scene.camera is None:
+        return None
+    return np.array(scene.camera.matrix_world.translation, dtype=np.float64)
+
+def fetchDetail(scene, props, objects, level):
+    """Build the detailed meshes of the given objects in one query, in the space of each object"""
+    by_building = {obj["building_id"]: obj for obj in objects}
+    with pooledConnection(props.host, props.name, props.user, props.password) as con:
+        rows = next(fetchAll(con, DETAIL_SQL.format(DETAIL_COLUMNS[level]), (list(by_building),)))
+    for record in shiftedRecords(decodeRows(rows), scene):
+        obj = by_building.pop(record["building_id"], None)
+        if obj is None or len(record["totals"]) == 0:
+            continue
+        matrix = np.linalg.inv(np.array(obj.matrix_world, dtype=np.float64))
+        mesh = buildMesh("{}_{}".format(obj["gmlid"], level),
+                         record["coords"] @ matrix[:3, :3].T + matrix[:3, 3], record["totals"])
+        mesh.use_fake_user = True
+        _detail_meshes[(obj["building_id"], level)] = mesh.name
+        # the state as fetched, showing this level is no edit
+        coords, totals = worldArrays(obj, mesh)
+        obj[hashKey(obj, level)] = geometryHash(coords, totals, objectAttributes(obj))
+    # buildings without surfaces at that level keep LoD1 and are not asked for again
+    _missing_detail.update((building_id, level) for building_id in by_building)
+    return 0
+
+def evictDetail():
+    """Delete the least recently used detailed meshes that are not shown beyond DETAIL_CACHE_MESHES"""
+    for key in list(_detail_meshes):
+        if len(_detail_meshes) <= DETAIL_CACHE_MESHES:
+            break
+        mesh = bpy.data.meshes.get(_detail_meshes[key])
+        # the fake user is the only user of a mesh that is not shown
+        if mesh is None or mesh.users <= 1:
+            del _detail_meshes[key]
+            if mesh is not None:
+                bpy.data.meshes.remove(mesh)
+    return 0
+
+def releaseLodMeshes(names=()):
+    """Drop the fake users of the LoD city meshes and delete the meshes no object uses"""
+    for name in set(names) | _lod1_meshes | set(_detail_meshes.values()):
+        mesh = bpy.data.meshes.get(name)
+        if mesh is not None:
+            mesh.use_fake_user = False
+            if mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+    _lod1_meshes.clear()
+    _detail_meshes.clear()
+    _missing_detail.clear()
+    return 0
+
+def updateDetail(scene):
+    """Show the detailed level for the LoD city buildings near the view and LoD1 for the others"""
+    props = scene.MyProperties
+    objects = [obj for collection in bpy.data.collections if "citydb_lod" in collection.keys()
+               for obj in collection.objects if "citydb_level" in obj.keys()]
+    if not objects:
+        # the LoD city was deleted, the meshes swapped out for it are not needed any more
+        if _lod1_meshes or _detail_meshes:
+            releaseLodMeshes()
+        return 0
+    eye = viewPoint(scene, props.tile_source)
+    if eye is None:
+        return 0
+    level = props.lod_detail
+    distances = np.linalg.norm(np.array([obj["citydb_center"][:] for obj in objects]) - eye, axis=1)
+    order = np.argsort(distances)
+    near = [objects[i] for i in order if distances[i] < props.lod_distance]
+    # nearest buildings first, a bounded number per update keeps the view responsive
+    wanted = [obj for obj in near if (obj["building_id"], level) not in _missing_detail
+              and bpy.data.meshes.get(_detail_meshes.get((obj["building_id"], level), "")) is None]
+    if wanted:
+        with timedStage("lod_fetch", min(len(wanted), MAX_DETAIL_FETCH)):
+            fetchDetail(scene, props, wanted[:MAX_DETAIL_FETCH], level)
+    swapped = 0
+    with timedStage("lod_swap") as counter:
+        near_names = set(obj.name for obj in near)
+        for obj in objects:
+            key = (obj["building_id"], level)
+            if obj.name in near_names and key in _detail_meshes:
+                _detail_meshes.move_to_end(key)
+                target, name = level, _detail_meshes[key]
+            else:
+                target, name = "LOD1", obj["citydb_lod1_mesh"]
+            # most objects keep their level, only the swapped ones look up their mesh
+            if obj["citydb_level"] == target:
+                continue
+            mesh = bpy.data.meshes.get(name)
+            if mesh is not None:
+                obj.data = mesh
+                obj["citydb_level"] = target
+                swapped += 1
+        counter["items"] = swapped
+    evictDetail()
+    return swapped
+
+def followDetail():
+    """Timer callback switching the levels of detail while Follow View is enabled for the LoD city"""
+    scene = bpy.context.scene
+    if scene is None or not scene.MyProperties.lod_follow_view:
+        return None
+    updateDetail(scene)
+    return TILE_FOLLOW_INTERVAL
+
+def toggleFollowDetail(self, context):
+    """Start or stop the timer of detail Follow View"""
+    if self.lod_follow_view and not bpy.app.timers.is_registered(followDetail):
+        bpy.app.timers.register(followDetail)
+    elif not self.lod_follow_view and bpy.app.timers.is_registered(followDetail):
+        bpy.app.timers.unregister(followDetail)
 
 # ------------------------------------------------------------------------
 #    Operator
@@ -210,14 +1688,161 @@ class DatabaseConnector(Operator):
         sql = bpy.data.scenes["Scene"].MyProperties.sql
         
         if db_host != "" and db_name != "" and db_user != "" and db_password != "" and sql != "":
-            rows = connectDatabase(db_host, db_name, db_user, db_password, sql)
-            # convert GeoJSON data to blender objects
-            geojsonParser(rows,context)
+            with instrumented(bpy.data.scenes["Scene"]):
+                importScene(bpy.data.scenes["Scene"], context.collection)
         else:
             ctypes.windll.user32.MessageBoxW(0, "Please enter all database Information!", "Warning", 1)
 
         return {'FINISHED'}
     
+class AsyncDatabaseConnector(Operator):
+    """Import in the background while Blender stays responsive, Esc cancels"""
+    bl_idname = "database.import_async"
+    bl_label = "Background Import"
+    
+    def execute(self, context):
+        props = context.scene.MyProperties
+        if props.host == "" or props.name == "" or props.user == "" or props.password == "" or props.sql == "":
+            self.report({'WARNING'}, "Please enter all database Information!")
+            return {'CANCELLED'}
+        # clear all objects in blender before adding database data
+        clearAll()
+        resetStats()
+        # meshes of earlier imports may have been edited or left without users by clearAll
+        _shared_meshes.clear()
+        self._credentials = (props.host, props.name, props.user, props.password)
+        self._grouping = props.grouping
+        self._instancing = props.instancing
+        self._batches = queue.Queue(maxsize=ASYNC_QUEUE_SIZE)
+        self._cancel = threading.Event()
+        self._state = {"pid": None, "srs": (None, None), "total": 0, "error": None, "done": False}
+        self._pending = []
+        self._rows = 0
+        self._start = time.perf_counter()
+        self._cache_root = cacheDirectory() if props.use_cache else None
+        self._cache_limit = props.cache_size * 1024 * 1024
+        self._worker = threading.Thread(target=importWorker, daemon=True,
+                                        args=(self._credentials, props.sql, props.itersize, self._cache_root,
+                                              self._batches, self._cancel, self._state))
+        self._worker.start()
+        window_manager = context.window_manager
+        self._timer = window_manager.event_timer_add(ASYNC_TIMER_INTERVAL, window=context.window)
+        window_manager.progress_begin(0, 1000)
+        window_manager.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+    
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            self._cancel.set()
+            if self._state["pid"] is not None:
+                cancelImport(self._credentials, self._state["pid"])
+            self.finish(context)
+            self.report({'WARNING'}, "Import cancelled after {} rows".format(self._rows))
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+        # create meshes from the decoded batches until the time slice is used up
+        deadline = time.perf_counter() + ASYNC_FRAME_BUDGET
+        while time.perf_counter() < deadline:
+            try:
+                records = self._batches.get_nowait()
+            except queue.Empty:
+                break
+            self._rows += len(records)
+            records = self._pending + records
+            self._pending = []
+            # the last building may continue in the next batch
+            if self._grouping == "BUILDING" and records:
+                last = records[-1]["building_id"]
+                while records and records[-1]["building_id"] == last:
+                    self._pending.insert(0, records.pop())
+            buildObjects(shiftedRecords(records, context.scene), context.collection, self._grouping,
+                         instancing=self._instancing)
+        if self._state["done"] and self._batches.empty():
+            buildObjects(shiftedRecords(self._pending, context.scene), context.collection, self._grouping,
+                         instancing=self._instancing)
+            storeSRS(context.scene, *self._state["srs"])
+            self.finish(context)
+            if self._cache_root is not None:
+                evictCache(self._cache_root, self._cache_limit)
+            if self._state["error"] is not None:
+                self.report({'ERROR'}, self._state["error"])
+                return {'CANCELLED'}
+            self.report({'INFO'}, "Imported {} rows".format(self._rows))
+            return {'FINISHED'}
+        elapsed = time.perf_counter() - self._start
+        total = max(self._state["total"], self._rows, 1)
+        context.window_manager.progress_update(int(1000 * self._rows / total))
+        if context.area is not None:
+            context.area.header_text_set("Imported {} of ~{} rows, {:.0f} rows/s, Esc to cancel".format(
+                self._rows, total, self._rows / elapsed if elapsed > 0 else 0))
+        return {'PASS_THROUGH'}
+    
+    def finish(self, context):
+        context.window_manager.event_timer_remove(self._timer)
+        context.window_manager.progress_end()
+        markChanged(context.scene)
+        finishStats(context.scene)
+        if context.area is not None:
+            context.area.header_text_set(None)
+    
+class TileLoader(Operator):
+    """Load the tiles in view and unload tiles beyond the memory budget"""
+    bl_idname = "database.load_tiles"
+    bl_label = "Load Visible Tiles"
+    
+    def execute(self, context):
+        props = context.scene.MyProperties
+        if props.host == "" or props.name == "" or props.user == "" or props.password == "" or props.sql == "":
+            self.report({'WARNING'}, "Please enter all database Information!")
+            return {'CANCELLED'}
+        with instrumented(context.scene):
+            loaded = loadVisibleTiles(context.scene)
+        self.report({'INFO'}, "Loaded {} tiles, {} tiles in memory".format(loaded, len(_tiles)))
+        return {'FINISHED'}
+    
+class LodLoader(Operator):
+    """Load every building at LoD1, detail is added near the view with Update Detail"""
+    bl_idname = "database.load_lod"
+    bl_label = "Load LoD1 City"
+    
+    def execute(self, context):
+        props = context.scene.MyProperties
+        if props.host == "" or props.name == "" or props.user == "" or props.password == "":
+            self.report({'WARNING'}, "Please enter all database Information!")
+            return {'CANCELLED'}
+        with instrumented(context.scene):
+            collection = loadLodCity(context.scene, props)
+        self.report({'INFO'}, "Loaded {} buildings".format(len(collection.objects)))
+        return {'FINISHED'}
+    
+class DetailUpdater(Operator):
+    """Swap in detailed meshes for the buildings near the view and LoD1 for the others"""
+    bl_idname = "database.update_detail"
+    bl_label = "Update Detail"
+    
+    def execute(self, context):
+        with instrumented(context.scene):
+            swapped = updateDetail(context.scene)
+        self.report({'INFO'}, "Switched {} buildings".format(swapped))
+        return {'FINISHED'}
+    
+class AttributeRefresher(Operator):
+    """Reload height and dates of the buildings in the scene without downloading geometry"""
+    bl_idname = "database.refresh_attributes"
+    bl_label = "Refresh Attributes"
+    
+    def execute(self, context):
+        props = context.scene.MyProperties
+        if props.host == "" or props.name == "" or props.user == "" or props.password == "":
+            self.report({'WARNING'}, "Please enter all database Information!")
+            return {'CANCELLED'}
+        with instrumented(context.scene):
+            with pooledConnection(props.host, props.name, props.user, props.password) as con:
+                updated = refreshAttributes(con, context.scene)
+        self.report({'INFO'}, "Updated {} objects".format(updated))
+        return {'FINISHED'}
+    
 class ClearInformation(Operator):
     """Clear Information Box"""
     bl_idname = "dbinfo.clear"
@@ -241,15 +1866,56 @@ class DatabaseExporter(Operator):
         db_name = bpy.data.scenes["Scene"].MyProperties.name
         db_user = bpy.data.scenes["Scene"].MyProperties.user
         db_password = bpy.data.scenes["Scene"].MyProperties.password
-        con = psycopg2.connect(
-        host=db_host,
-        database=db_name,
-        user=db_user,
-        password=db_password
+        batch_size = bpy.data.scenes["Scene"].MyProperties.export_batch_size
+        incremental = bpy.data.scenes["Scene"].MyProperties.incremental_export
+        with instrumented(context.scene):
+            with pooledConnection(db_host, db_name, db_user, db_password) as con:
+                try:
+                    srid = exportSRID(context.scene, con)
+                except ValueError as error:
+                    self.report({'ERROR'}, str(error))
+                    return {'CANCELLED'}
+                createTable(con, srid)
+                exportToDatabase(con, context, batch_size, incremental, srid)
+        return {'FINISHED'}
+
+class FileExporter(Operator, ExportHelper):
+    """Export the buildings of the scene to a CityJSON or GeoPackage file"""
+    bl_idname = "export_scene.citydb_file"
+    bl_label = "Export to File"
+    
+    filename_ext = ".json"
+    filter_glob: StringProperty(
+        default = "*.json;*.gpkg",
+        options = {'HIDDEN'},
         )
-        createTable(con)
-        exportToDatabase(con, context)
-        con.close()
+    file_format: EnumProperty(
+        name = "Format",
+        description = "Format of the exported file",
+        items = [("CITYJSON", "CityJSON", "CityJSON 1.1 with quantised vertices"),
+                 ("GPKG", "GeoPackage", "GeoPackage with a MultiPolygonZ feature per object"),
+                 ],
+        default = "CITYJSON",
+        )
+    
+    def check(self, context):
+        # keep the extension in line with the chosen format
+        self.filename_ext = ".gpkg" if self.file_format == "GPKG" else ".json"
+        return ExportHelper.check(self, context)
+    
+    def execute(self, context):
+        srid = context.scene.get("citydb_srid")
+        if srid is None:
+            self.report({'ERROR'}, "The coordinate system is unknown, import from a 3DCityDB first")
+            return {'CANCELLED'}
+        with instrumented(context.scene):
+            if self.file_format == "GPKG":
+                written = writeGeoPackage(self.filepath, context, int(srid),
+                                          context.scene.MyProperties.export_batch_size)
+                self.report({'INFO'}, "Exported {} objects".format(written))
+            else:
+                written = writeCityJSON(self.filepath, context, int(srid))
+                self.report({'INFO'}, "Exported {} vertices".format(written))
         return {'FINISHED'}
 
 class MergeSurfaces(Operator):
@@ -258,7 +1924,8 @@ class MergeSurfaces(Operator):
     bl_label = "Merge Surfaces to Buildings"
     
     def execute(self,context):
-        mergeSurfaces(context)
+        with instrumented(context.scene):
+            mergeSurfaces(context)
         return {'FINISHED'}
     
 class SeparateBuildingsToSurfaces(Operator):
@@ -267,7 +1934,8 @@ class SeparateBuildingsToSurfaces(Operator):
     bl_label = "Separate Buildings to Surfaces"
     
     def execute(self,context):
-        separateSurfaces(context)
+        with instrumented(context.scene):
+            separateSurfaces(context)
         return {'FINISHED'}
 
 class PopupWindow(Operator):
@@ -280,6 +1948,8 @@ class PopupWindow(Operator):
     construction_label = "Year of Construction"
     demolition_label = "Year of Demolition"
     def execute(self, context):
+        # the attributes may have been edited in the dialog
+        markChanged(context.scene)
         return {'FINISHED'}
     
     def invoke(self, context, event):
@@ -340,7 +2010,7 @@ class MyProperties(PropertyGroup):
         name = "SQL",
         description = "SQL",
         default = """SELECT b.id AS building_id, co_ts.gmlid AS surface_gmlid, b.measured_height AS height, 
-        co.gmlid AS gmlid, ST_Asgeojson(ST_Collect(sg.geometry)) AS geometry,
+        co.gmlid AS gmlid, ST_AsBinary(ST_Collect(sg.geometry)) AS geometry,
         b.year_of_construction AS year_of_construction, b.year_of_demolition AS year_of_demolition
         FROM citydb.thematic_surface AS ts INNER JOIN citydb.cityobject AS co_ts 
         ON (co_ts.id = ts.id) INNER JOIN citydb.surface_geometry AS sg 
@@ -350,6 +2020,113 @@ class MyProperties(PropertyGroup):
         maxlen = 1024,
         )
 #select building_id, gmlid, height, year_of_construction, year_of_demolition, ST_asgeojson(geometry) as geometry from blender_export;
+    streaming: BoolProperty(
+        name = "Streaming Import",
+        description = "Fetch rows in batches through a server-side cursor instead of loading the whole result",
+        default = True,
+        )
+    itersize: IntProperty(
+        name = "Batch Size",
+        description = "Number of rows fetched from the server per batch in streaming import",
+        default = 2000,
+        min = 1,
+        )
+    parallel_workers: IntProperty(
+        name = "Parallel Connections",
+        description = "Split the import by building id range and run the parts concurrently on this many connections",
+        default = 1,
+        min = 1,
+        max = POOL_MAX_CONNECTIONS,
+        )
+    grouping: EnumProperty(
+        name = "Mesh Grouping",
+        description = "Create one mesh per thematic surface row or per building",
+        items = [("SURFACE", "Surface", "One mesh per row of the query"),
+                 ("BUILDING", "Building", "One mesh per building, rows have to be ordered by building_id"),
+                 ("TILE", "Tile", "One mesh per tile in tiled loading, one mesh for all rows otherwise"),
+                 ],
+        default = "SURFACE",
+        )
+    instancing: BoolProperty(
+        name = "Share Identical Meshes",
+        description = "Give geometry that repeats shifted in space one shared mesh and place each copy by its object location, editing a shared mesh changes all copies",
+        default = False,
+        )
+    export_batch_size: IntProperty(
+        name = "Export Batch Size",
+        description = "Number of objects sent per COPY batch when exporting",
+        default = 10000,
+        min = 1,
+        )
+    use_cache: BoolProperty(
+        name = "Use Geometry Cache",
+        description = "Keep decoded geometry on disk and reuse it while the database is unchanged",
+        default = True,
+        )
+    cache_size: IntProperty(
+        name = "Cache Size (MB)",
+        description = "Disk space of the geometry cache, least recently used queries are deleted beyond it",
+        default = 4096,
+        min = 1,
+        )
+    tile_size: FloatProperty(
+        name = "Tile Size",
+        description = "Edge length of the tiles in the units of the database CRS",
+        default = 500.0,
+        min = 1.0,
+        )
+    tile_budget: IntProperty(
+        name = "Tile Budget (MB)",
+        description = "Memory budget of the loaded tiles, the least recently seen tiles are unloaded beyond it",
+        default = 1024,
+        min = 1,
+        )
+    tile_source: EnumProperty(
+        name = "Load Tiles In",
+        description = "View that decides which tiles are loaded and which buildings are shown in detail",
+        items = [("VIEWPORT", "Viewport", "Tiles around the view of the 3D viewport"),
+                 ("CAMERA", "Camera", "Tiles in the frustum of the active camera"),
+                 ],
+        default = "VIEWPORT",
+        )
+    tile_follow_view: BoolProperty(
+        name = "Follow View",
+        description = "Keep loading the tiles in view while the view moves",
+        default = False,
+        update = toggleFollowView,
+        )
+    lod_detail: EnumProperty(
+        name = "Detail Level",
+        description = "Level of detail shown for the buildings near the view",
+        items = [("LOD2", "LoD2", "Thematic surfaces of LoD2"),
+                 ("LOD3", "LoD3", "Thematic surfaces of LoD3"),
+                 ],
+        default = "LOD2",
+        )
+    lod_distance: FloatProperty(
+        name = "Detail Distance",
+        description = "Buildings whose centre is closer to the view than this are shown at the detail level",
+        default = 300.0,
+        min = 0.0,
+        )
+    lod_follow_view: BoolProperty(
+        name = "Follow View",
+        description = "Keep switching the levels of detail while the view moves",
+        default = False,
+        update = toggleFollowDetail,
+        )
+    incremental_export: BoolProperty(
+        name = "Export Changes Only",
+        description = "Only write objects changed since their import or last export, and delete removed ones",
+        default = True,
+        )
+    stats_path: StringProperty(
+        name = "Statistics File",
+        description = "JSON file the stage timings are written to after each operation, nothing is written when empty",
+        default = "",
+        subtype = "FILE_PATH",
+        maxlen = 1024,
+        )
     gmlid: StringProperty(
         name = "gmlid",
         description = "GMLID",
@@ -374,14 +2151,45 @@ class Database_PT_Connect_Panel(Panel):
         layout.prop(props, "user")
         layout.prop(props, "password")
         layout.prop(props, "sql")
+        layout.prop(props, "streaming")
+        layout.prop(props, "itersize")
+        layout.prop(props, "parallel_workers")
+        layout.prop(props, "grouping")
+        layout.prop(props, "instancing")
+        layout.prop(props, "use_cache")
+        layout.prop(props, "cache_size")
+        layout.prop(props, "export_batch_size")
+        layout.prop(props, "incremental_export")
         layout.separator()
         
         layout.operator(DatabaseConnector.bl_idname)
+        layout.operator(AsyncDatabaseConnector.bl_idname)
+        layout.operator(AttributeRefresher.bl_idname)
+        box = layout.box()
+        box.prop(props, "tile_size")
+        box.prop(props, "tile_budget")
+        box.prop(props, "tile_source")
+        box.prop(props, "tile_follow_view")
+        box.operator(TileLoader.bl_idname)
+        box = layout.box()
+        box.prop(props, "lod_detail")
+        box.prop(props, "lod_distance")
+        box.prop(props, "lod_follow_view")
+        box.operator(LodLoader.bl_idname)
+        box.operator(DetailUpdater.bl_idname)
         layout.operator(DatabaseExporter.bl_idname)
+        layout.operator(FileExporter.bl_idname)
         layout.operator(MergeSurfaces.bl_idname)
         layout.operator(SeparateBuildingsToSurfaces.bl_idname)
         layout.operator(PopupWindow.bl_idname)
         layout.operator(ClearInformation.bl_idname)
+        # where the time of the last operation went
+        box = layout.box()
+        box.label(text="Last Operation")
+        for stage, entry in statsSnapshot():
+            box.label(text="{}: {:.3f} s, {} calls, {} items".format(
+                stage, entry["seconds"], entry["calls"], entry["items"]))
+        box.prop(props, "stats_path")
         
 # ------------------------------------------------------------------------
 #    Registration
@@ -390,8 +2198,14 @@ classes = (
     MyProperties,
     Database_PT_Connect_Panel,
     DatabaseConnector,
+    AsyncDatabaseConnector,
+    TileLoader,
+    LodLoader,
+    DetailUpdater,
+    AttributeRefresher,
     ClearInformation,
     DatabaseExporter,
+    FileExporter,
     MergeSurfaces,
     SeparateBuildingsToSurfaces,
     PopupWindow,
@@ -401,8 +2215,20 @@ def register():
     for cls in classes:
         register_class(cls)
     bpy.types.Scene.MyProperties = PointerProperty(type=MyProperties)
+    bpy.app.handlers.depsgraph_update_post.append(trackChanges)
+    bpy.app.handlers.load_post.append(resetChanges)
+    bpy.app.timers.register(evictIdlePools, first_interval=60.0, persistent=True)
     
 def unregister():
+    if bpy.app.timers.is_registered(followView):
+        bpy.app.timers.unregister(followView)
+    if bpy.app.timers.is_registered(followDetail):
+        bpy.app.timers.unregister(followDetail)
+    if bpy.app.timers.is_registered(evictIdlePools):
+        bpy.app.timers.unregister(evictIdlePools)
+    closePools()
+    bpy.app.handlers.load_post.remove(resetChanges)
+    bpy.app.handlers.depsgraph_update_post.remove(trackChanges)
     for cls in reversed(classes):
         unregister_class(cls)
     del bpy.types.Scene.MyProperties
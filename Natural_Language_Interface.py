@@ -9,11 +9,13 @@ bl_info = {
     "wiki_url": "",
     "category": "3D View",
 }
-#import sys
+import sys
+import bisect
+import functools
 import numpy as np
 from mathutils import Vector
-import nltk
-from nltk.stem import WordNetLemmatizer
+from mathutils.bvhtree import BVHTree
+from mathutils.kdtree import KDTree
 #from nltk.tag.senna import SennaTagger
 import bpy
 from bpy.props import (StringProperty,
@@ -26,42 +28,238 @@ from bpy.types import (Panel,
 from bpy.utils import (register_class,
                        unregister_class
                        )
+from bpy.app.handlers import persistent
 #nltk.download('punkt')
 #nltk.download('wordnet')
 #nltk.download('averaged_perceptron_tagger')
+# pixel distance between the rays of the coarse grid in the visibility test
+SAMPLE_STEP = 8
+# BVH tree of the candidates of the last visibility test
+_bvh_cache = {"key": None, "tree": None, "face_offsets": None}
+# query vocabulary: height adjectives with their comparison, comparatives taking a number,
+# superlatives with their sort order, date verbs with their column and date prepositions
+HEIGHT_WORDS = {"high": (">", 30.0), "tall": (">", 30.0), "low": ("<", 15.0)}
+HEIGHT_COMPARATIVES = {"higher": ">", "taller": ">", "lower": "<"}
+HEIGHT_SUPERLATIVES = {"highest": True, "tallest": True, "lowest": False}
+DATE_VERBS = {"constructed": "construction", "built": "construction",
+              "demolished": "demolition", "destroyed": "demolition"}
+DATE_OPERATORS = {"before": "<", "after": ">", "in": "=="}
+COMPARISONS = {"<": np.less, ">": np.greater, "==": np.equal}
+# directions in camera space pointing to each side of the camera, and the distance meant by "near"
+SIDE_AXES = {"left": (-1.0, 0.0, 0.0), "right": (1.0, 0.0, 0.0),
+             "front": (0.0, 0.0, -1.0), "behind": (0.0, 0.0, 1.0)}
+NEAR_DISTANCE = 100.0
+# columns of citydb.building behind the plan columns, formatted with the table alias
+SQL_COLUMNS = {"height": "{0}.measured_height",
+               "construction": "EXTRACT(YEAR FROM {0}.year_of_construction)",
+               "demolition": "EXTRACT(YEAR FROM {0}.year_of_demolition)"}
+SQL_OPERATORS = {"<": "<", ">": ">", "==": "="}
+IMPORTER_NAME = "3DCityDB Importer/Exporter"
+# parsed queries kept with their plans
+QUERY_CACHE_SIZE = 256
+# tokenizer, lemmatizer and tagger once NLTK is loaded
+_pipeline = None
+# columnar attribute index of the scene, None after objects changed
+_attribute_index = None
 # ------------------------------------------------------------------------
 #    Functions
 # ------------------------------------------------------------------------
+def world_bounding_boxes(objects):
+    """World-space corners of the bounding boxes of the objects as an (N, 8, 3) array"""
+    corners = np.array([obj.bound_box for obj in objects], dtype=np.float64).reshape(-1, 8, 3)
+    matrices = np.array([obj.matrix_world for obj in objects], dtype=np.float64).reshape(-1, 4, 4)
+    return np.einsum('nij,nkj->nki', matrices[:, :3, :3], corners) + matrices[:, None, :3, 3]
+
+def frustum_planes(scene, camera):
+    """Inward normals and offsets of the planes bounding the camera frustum in world space"""
+    matrix = np.array(camera.matrix_world, dtype=np.float64)
+    origin = matrix[:3, 3]
+    forward = -matrix[:3, 2] / np.linalg.norm(matrix[:3, 2])
+    # frame corners in order top right, bottom right, bottom left, top left
+    frame = np.array([corner.to_tuple() for corner in camera.data.view_frame(scene=scene)])
+    corners = frame @ matrix[:3, :3].T + origin
+    center = corners.mean(axis=0)
+    normals = []
+    for i in range(4):
+        edge = corners[(i + 1) % 4] - corners[i]
+        ray = forward if camera.data.type == 'ORTHO' else corners[i] - origin
+        normal = np.cross(edge, ray)
+        # orient every side plane towards the middle of the frame
+        if np.dot(normal, center - corners[i]) < 0:
+            normal = -normal
+        normals.append(normal / np.linalg.norm(normal))
+    offsets = [-np.dot(normal, corner) for normal, corner in zip(normals, corners)]
+    # near and far clipping planes
+    normals += [forward, -forward]
+    offsets += [-np.dot(forward, origin) - camera.data.clip_start, np.dot(forward, origin) + camera.data.clip_end]
+    return np.array(normals), np.array(offsets)
+
+def frustum_cull(scene, camera, objects):
+    """Objects whose bounding box is not entirely outside one of the frustum planes"""
+    if not objects:
+        return []
+    normals, offsets = frustum_planes(scene, camera)
+    distances = world_bounding_boxes(objects) @ normals.T + offsets
+    outside = (distances < 0).all(axis=1).any(axis=1)
+    return [obj for obj, out in zip(objects, outside) if not out]
+
+def candidate_tree(candidates):
+    """BVH tree over the faces of the candidates in world space, reused until the scene changes"""
+    key = tuple(obj.name for obj in candidates)
+    if _bvh_cache["key"] == key:
+        return _bvh_cache["tree"], _bvh_cache["face_offsets"]
+    vertices = []
+    polygons = []
+    face_offsets = [0]
+    vertex_offset = 0
+    for obj in candidates:
+        mesh = obj.data
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", co)
+        matrix = np.array(obj.matrix_world, dtype=np.float64)
+        vertices.append(co.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3])
+        indices = np.empty(len(mesh.loops), dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", indices)
+        starts = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get("loop_start", starts)
+        totals = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get("loop_total", totals)
+        polygons.extend((indices[start:start + total] + vertex_offset).tolist()
+                        for start, total in zip(starts, totals))
+        vertex_offset += len(mesh.vertices)
+        face_offsets.append(len(polygons))
+    vertices = np.concatenate(vertices) if vertices else np.zeros((0, 3))
+    tree = BVHTree.FromPolygons(vertices.tolist(), polygons)
+    _bvh_cache.update(key=key, tree=tree, face_offsets=face_offsets)
+    return tree, face_offsets
+
 def occlusion_test(scene, depsgraph, camera, resolution_x, resolution_y):
+    # first stage: only objects inside the view frustum can be visible
+    objects = [obj for obj in scene.objects if obj.type == 'MESH' and obj.visible_get()]
+    candidates = frustum_cull(scene, camera, objects)
+    if not candidates:
+        return set()
+    tree, face_offsets = candidate_tree(candidates)
+
     # get vectors which define view frustum of camera
     top_right, _, bottom_left, top_left = camera.data.view_frame(scene=scene)
-
-    camera_quaternion = camera.matrix_world.to_quaternion()
+    rotation = np.array(camera.matrix_world.to_quaternion().to_matrix(), dtype=np.float64)
     camera_translation = camera.matrix_world.translation
 
     # get iteration range for both the x and y axes, sampled based on the resolution
     x_range = np.linspace(top_left[0], top_right[0], resolution_x)
     y_range = np.linspace(top_left[1], bottom_left[1], resolution_y)
-
     z_dir = top_left[2]
 
-    hit_data = set()
+    hits = {}
+    def cast(pixels):
+        # normalized ray directions of all new pixels at once
+        pixels = [pixel for pixel in dict.fromkeys(pixels) if pixel not in hits]
+        if not pixels:
+            return
+        columns, rows = np.array(pixels).T
+        directions = np.column_stack((x_range[columns], y_range[rows], np.full(len(pixels), z_dir))) @ rotation.T
+        directions /= np.linalg.norm(directions, axis=1)[:, None]
+        for pixel, direction in zip(pixels, directions):
+            _, _, index, _ = tree.ray_cast(camera_translation, Vector(direction))
+            hits[pixel] = -1 if index is None else bisect.bisect_right(face_offsets, index) - 1
+
+    # second stage: cast a coarse grid and refine only the cells whose corners hit different objects
+    xs = sorted(set(range(0, resolution_x, SAMPLE_STEP)) | {resolution_x - 1})
+    ys = sorted(set(range(0, resolution_y, SAMPLE_STEP)) | {resolution_y - 1})
+    cells = [(x0, y0, x1, y1) for x0, x1 in zip(xs, xs[1:]) for y0, y1 in zip(ys, ys[1:])]
+    cast([(x, y) for x in xs for y in ys])
+    while cells:
+        refined = []
+        for x0, y0, x1, y1 in cells:
+            if len({hits[(x0, y0)], hits[(x1, y0)], hits[(x0, y1)], hits[(x1, y1)]}) == 1:
+                continue
+            splits_x = [x0, (x0 + x1) // 2, x1] if x1 - x0 > 1 else [x0, x1]
+            splits_y = [y0, (y0 + y1) // 2, y1] if y1 - y0 > 1 else [y0, y1]
+            if len(splits_x) == 2 and len(splits_y) == 2:
+                continue
+            refined += [(a, b, c, d) for a, c in zip(splits_x, splits_x[1:]) for b, d in zip(splits_y, splits_y[1:])]
+        cast([(x, y) for x0, y0, x1, y1 in refined for x in (x0, x1) for y in (y0, y1)])
+        cells = refined
 
-    # iterate over all X/Y coordinates
-    for x in x_range:
-        for y in y_range:
-            # get current pixel vector from camera center to pixel
-            pixel_vector = Vector((x, y, z_dir))
-            # rotate that vector according to camera rotation
-            pixel_vector.rotate(camera_quaternion)
-            pixel_vector.normalized()
+    # third stage: a candidate inside one coarse cell is missed by its corners, cast one ray at its centre
+    centers = world_bounding_boxes(candidates).mean(axis=1)
+    local = (centers - np.array(camera_translation, dtype=np.float64)) @ rotation
+    ahead = local[local[:, 2] < 0]
+    # centres outside the view are moved to its border, like a pixel at the edge of the grid
+    plane = ahead * (z_dir / ahead[:, 2])[:, None]
+    plane[:, 0] = np.clip(plane[:, 0], min(x_range[0], x_range[-1]), max(x_range[0], x_range[-1]))
+    plane[:, 1] = np.clip(plane[:, 1], min(y_range[0], y_range[-1]), max(y_range[0], y_range[-1]))
+    directions = plane @ rotation.T
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    visible = {index for index in hits.values() if index >= 0}
+    for direction in directions:
+        _, _, index, _ = tree.ray_cast(camera_translation, Vector(direction))
+        if index is not None:
+            visible.add(bisect.bisect_right(face_offsets, index) - 1)
 
-            is_hit, _, _, _, hit_obj, _ = scene.ray_cast(depsgraph, camera_translation, pixel_vector)
+    return {candidates[index] for index in visible}
 
-            if is_hit:
-                hit_data.add(hit_obj)
+def parseNumber(value):
+    """Float of an attribute string, NaN for 'None' or missing values"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
 
-    return hit_data
+def parseYear(value):
+    """Year of a date string such as '1935-01-01', NaN for 'None' or missing values"""
+    return parseNumber(str(value)[:4])
+
+def buildAttributeIndex(scene):
+    """Columnar copy of the building attributes and world bounding boxes of all mesh objects"""
+    objects = [obj for obj in scene.objects if obj.type == 'MESH']
+    boxes = world_bounding_boxes(objects)
+    return {
+        "objects": objects,
+        "object_count": len(scene.objects),
+        # bumped by the importer on every import and attribute refresh
+        "generation": scene.get("citydb_generation", 0),
+        "height": np.array([parseNumber(obj.get("height")) for obj in objects], dtype=np.float64),
+        "construction": np.array([parseYear(obj.get("year_of_construction")) for obj in objects], dtype=np.float64),
+        "demolition": np.array([parseYear(obj.get("year_of_demolition")) for obj in objects], dtype=np.float64),
+        "corners": boxes,
+        "centers": boxes.mean(axis=1),
+        "kdtree": None,
+    }
+
+def attributeIndex(scene):
+    """The attribute index of the scene, rebuilt when objects changed since it was built"""
+    global _attribute_index
+    if (_attribute_index is None or _attribute_index["object_count"] != len(scene.objects)
+            or _attribute_index["generation"] != scene.get("citydb_generation", 0)):
+        _attribute_index = buildAttributeIndex(scene)
+    return _attribute_index
+
+def selectedMask(context, index):
+    """Mask of the indexed objects that are currently selected"""
+    selected = set(context.selected_objects)
+    return np.fromiter((obj in selected for obj in index["objects"]), dtype=bool, count=len(index["objects"]))
+
+def applySelection(index, mask):
+    """Replace the selection by the indexed objects where mask is true"""
+    bpy.ops.object.select_all(action='DESELECT')
+    objects = index["objects"]
+    for i in np.flatnonzero(mask):
+        objects[i].select_set(True)
+
+@persistent
+def invalidate_caches(scene, depsgraph=None):
+    """Drop the cached BVH tree and attribute index when objects change"""
+    global _attribute_index
+    if depsgraph is None:
+        return
+    # selection changes are object updates too, attribute edits are counted by citydb_generation instead
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Object) and (update.is_updated_geometry or update.is_updated_transform):
+            _bvh_cache["key"] = None
+            _attribute_index = None
+            return
 
 def selectObjectsInCameraView(context):
     # sampling resolution of raytracing from the camera
@@ -77,96 +275,203 @@ def selectObjectsInCameraView(context):
     for obj in visible_objs:
         obj.select_set(True)
         
-def selectObjectsByHeight(context, adjs, numbers):
-    # Get selected objects from the context  
-    selected_objs = bpy.context.selected_objects
-    if "highest" in adjs:
-        height = 0
-        building = None
-    if "lowest" in adjs:
-        height = float('inf')
-        building = None    
-    if "high" in adjs:
-        height = 30
-        buildings = []
-    if "low" in adjs:
-        height = 15
-        buildings = []   
-    if "higher" in adjs or "lower" in adjs:
-        height = numbers[0]
-        buildings = []
-    for obj in selected_objs:
-        if "height" in obj.keys():
-            if "highest" in adjs:
-                if float(obj['height']) > height:
-                    height = float(obj['height'])
-                    building = obj                    
-            if "lowest" in adjs:
-                if float(obj['height']) < height:
-                    height = float(obj['height'])
-                    building = obj
-            if "high" in adjs:
-                if float(obj['height']) > height:
-                    buildings.append(obj)
-            if "low" in adjs:
-                if float(obj['height']) < height:
-                    buildings.append(obj)
-            if "higher" in adjs:
-                if float(obj['height']) > float(height):
-                    buildings.append(obj)
-            if "lower" in adjs:
-                if float(obj['height']) < float(height):
-                    buildings.append(obj)    
-    if "highest" in adjs or "lowest" in adjs:
-        bpy.ops.object.select_all(action='DESELECT')
-        building.select_set(True)
-    if "high" in adjs or "low" in adjs or "higher" in adjs or "lower" in adjs:
-        bpy.ops.object.select_all(action='DESELECT')
-        for obj in buildings:
-            obj.select_set(True)
-   
-def selectObjectsByDate(context, verbs, cons, numbers):
-    selected_objs = bpy.context.selected_objects
-    bpy.ops.object.select_all(action='DESELECT')
-    for obj in selected_objs:
-        if "constructed" in verbs:
-            if "year_of_construction" in obj.keys():
-                if "before" in cons:
-                    if int(obj['year_of_construction'][:4]) < int(numbers[0]):
-                        obj.select_set(True)
-                if "after" in cons:
-                    if int(obj['year_of_construction'][:4]) > int(numbers[0]):
-                        obj.select_set(True)
-                if "in" in cons:
-                    if int(obj['year_of_construction'][:4]) == int(numbers[0]):
-                        obj.select_set(True)                                
-        if "demolished" in verbs or "destroyed" in verbs:
-            if "year_of_demolition" in obj.keys():
-                if "before" in cons:
-                    if int(obj['year_of_demolition'][:4]) < int(numbers[0]):
-                        obj.select_set(True)
-                if "after" in cons:
-                    if int(obj['year_of_demolition'][:4]) > int(numbers[0]):
-                        obj.select_set(True)
-                if "in" in cons:
-                    if int(obj['year_of_demolition'][:4]) == int(numbers[0]):
-                        obj.select_set(True)
-                            
-def selectObjectsByPosition(context, adjs):
-    selected_objs = context.selected_objects
-    camera_location = bpy.data.objects['Camera'].location
-    if "left" in adjs or "right" in adjs:
-        bpy.ops.object.select_all(action='DESELECT')
-
-    for obj in selected_objs:
-        if obj.type == "MESH":
-            coords = [v.co for v in obj.data.vertices]
-        if "left" in adjs:          
-            if all(coord.y < camera_location.y for coord in coords):
-                obj.select_set(True)
-        if "right" in adjs:
-            if all(coord.y > camera_location.y for coord in coords):
-                obj.select_set(True)
+def nlpPipeline():
+    """Tokenizer, lemmatizer and tagger, NLTK and its models are loaded on the first query only"""
+    global _pipeline
+    if _pipeline is None:
+        import nltk
+        from nltk.stem import WordNetLemmatizer
+        lemmatizer = WordNetLemmatizer()
+        # WordNet is a lazy corpus, the first lemmatization loads it
+        lemmatizer.lemmatize("building")
+        _pipeline = (nltk.word_tokenize, lemmatizer.lemmatize, nltk.pos_tag)
+    return _pipeline
+
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def compileQuery(query):
+    """Tokenize, lemmatize and tag a normalized query and compile it into a predicate plan"""
+    tokenize, lemmatize, pos_tag = nlpPipeline()
+    # tokenization
+    tokens = tokenize(query)
+    # lemmatization
+    lemmatized_tokens = [lemmatize(token) for token in tokens]
+    # tag the pos
+#    tagged_tokens = SennaTagger(home+'/senna').tag(lemmatized_tokens)
+    tagged_tokens = pos_tag(lemmatized_tokens)
+    return compilePlan(tagged_tokens)
+
+def parseQuery(query):
+    """Predicate plan of a query, queries differing only in case or spacing share a cached plan"""
+    return compileQuery(" ".join(query.lower().split()))
+
+def isNumber(token):
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+def numberAfter(tokens, i, reach):
+    """First number within reach tokens after position i and its position"""
+    for j in range(i + 1, min(i + 1 + reach, len(tokens))):
+        if isNumber(tokens[j]):
+            return float(tokens[j]), j
+    return None, i
+
+def compilePlan(tagged_tokens):
+    """Compile tagged query tokens into a predicate plan, an OR of AND groups of predicates"""
+    if not any(token == "building" and pos.startswith('N') for token, pos in tagged_tokens):
+        return None
+    tokens = [token.lower() for token, _ in tagged_tokens]
+    groups = []
+    predicates = []
+    # dates refer to the construction unless a verb says otherwise
+    column = "construction"
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == "or":
+            groups.append(tuple(predicates))
+            predicates = []
+        elif token in HEIGHT_WORDS:
+            predicates.append(("compare", "height") + HEIGHT_WORDS[token])
+        elif token in HEIGHT_COMPARATIVES:
+            value, i = numberAfter(tokens, i, 2)
+            if value is not None:
+                predicates.append(("compare", "height", HEIGHT_COMPARATIVES[token], value))
+        elif token in HEIGHT_SUPERLATIVES:
+            count = int(float(tokens[i - 1])) if i > 0 and isNumber(tokens[i - 1]) else 1
+            predicates.append(("top", "height", count, HEIGHT_SUPERLATIVES[token]))
+        elif token in DATE_VERBS:
+            column = DATE_VERBS[token]
+        elif token == "between":
+            low, j = numberAfter(tokens, i, 1)
+            high, j = numberAfter(tokens, j + 1, 1)
+            if low is not None and high is not None:
+                predicates.append(("range", column, min(low, high), max(low, high)))
+                i = j
+        elif token in DATE_OPERATORS:
+            value, i = numberAfter(tokens, i, 1)
+            if value is not None:
+                predicates.append(("compare", column, DATE_OPERATORS[token], value))
+        elif token in SIDE_AXES:
+            predicates.append(("side", token))
+        elif token == "near":
+            predicates.append(("near", NEAR_DISTANCE))
+        elif token == "within":
+            value, i = numberAfter(tokens, i, 1)
+            if value is not None:
+                predicates.append(("near", value))
+        i += 1
+    groups.append(tuple(predicates))
+    return ("or", tuple(("and", group) for group in groups if group))
+
+def groupToSQL(predicates, alias):
+    """SQL condition on citydb.building rows named alias for one AND group of a plan"""
+    conditions = []
+    params = []
+    for predicate in predicates:
+        if predicate[0] == "compare":
+            _, column, operator, value = predicate
+            conditions.append("{} {} %s".format(SQL_COLUMNS[column].format(alias), SQL_OPERATORS[operator]))
+            params.append(value)
+        elif predicate[0] == "range":
+            _, column, low, high = predicate
+            conditions.append("{} BETWEEN %s AND %s".format(SQL_COLUMNS[column].format(alias)))
+            params += [low, high]
+    # highest/lowest pick among the buildings matching the rest of the group
+    for predicate in predicates:
+        if predicate[0] == "top":
+            _, column, count, descending = predicate
+            rest, rest_params = groupToSQL([p for p in predicates if p[0] != "top"], "t")
+            conditions.append("{0}.id IN (SELECT t.id FROM citydb.building AS t WHERE {1} AND {2} IS NOT NULL "
+                              "ORDER BY {2} {3} LIMIT %s)".format(alias, rest, SQL_COLUMNS[column].format("t"),
+                                                                   "DESC" if descending else "ASC"))
+            params += rest_params + [count]
+    return " AND ".join(conditions) or "TRUE", params
+
+def planToSQL(plan):
+    """Condition on the building_id of the import query, its parameters and whether predicates were dropped"""
+    groups = []
+    params = []
+    for _, predicates in plan[1]:
+        condition, group_params = groupToSQL(predicates, "b")
+        groups.append("(" + condition + ")")
+        params += group_params
+    # positions depend on the camera in the scene and cannot be evaluated in the database
+    dropped = any(predicate[0] in ("side", "near") for _, predicates in plan[1] for predicate in predicates)
+    condition = "q.building_id IN (SELECT b.id FROM citydb.building AS b WHERE {})".format(
+        " OR ".join(groups) or "TRUE")
+    return condition, params, dropped
+
+def importerModule():
+    """Module of the 3DCityDB Importer/Exporter add-on, None when it is not enabled"""
+    for module in list(sys.modules.values()):
+        if getattr(module, "bl_info", {}).get("name") == IMPORTER_NAME and hasattr(module, "importScene"):
+            return module
+    return None
+
+def centerTree(index):
+    """KD-tree over the bounding box centres of the indexed objects, built on first use"""
+    if index["kdtree"] is None:
+        tree = KDTree(len(index["objects"]))
+        for i, center in enumerate(index["centers"]):
+            tree.insert(center, i)
+        tree.balance()
+        index["kdtree"] = tree
+    return index["kdtree"]
+
+def evaluatePredicate(predicate, index, camera):
+    """Mask of the indexed objects satisfying one predicate, comparisons with NaN are false"""
+    kind = predicate[0]
+    if kind == "compare":
+        _, column, operator, value = predicate
+        return COMPARISONS[operator](index[column], value)
+    if kind == "range":
+        _, column, low, high = predicate
+        return (index[column] >= low) & (index[column] <= high)
+    if kind in ("side", "near") and camera is None:
+        return np.zeros(len(index["objects"]), dtype=bool)
+    location = np.array(camera.matrix_world.translation, dtype=np.float64)
+    if kind == "side":
+        # the whole bounding box has to lie on that side of the plane through the camera across the view axis
+        rotation = np.array(camera.matrix_world.to_quaternion().to_matrix(), dtype=np.float64)
+        axis = rotation @ np.array(SIDE_AXES[predicate[1]], dtype=np.float64)
+        return ((index["corners"] - location) @ axis > 0).all(axis=1)
+    if kind == "near":
+        mask = np.zeros(len(index["objects"]), dtype=bool)
+        for _, i, _ in centerTree(index).find_range(location, predicate[1]):
+            mask[i] = True
+        return mask
+    return np.ones(len(index["objects"]), dtype=bool)
+
+def topMask(values, mask, count, descending):
+    """Mask of the count highest or lowest values among the masked ones"""
+    candidates = np.flatnonzero(mask & ~np.isnan(values))
+    order = candidates[np.argsort(values[candidates], kind="stable")]
+    chosen = order[::-1][:count] if descending else order[:count]
+    result = np.zeros(len(values), dtype=bool)
+    result[chosen] = True
+    return result
+
+def evaluatePlan(plan, index, base, camera):
+    """Mask of the objects selected by a plan, starting from the base mask"""
+    # a plan without conditions selects all of the base, like TRUE in planToSQL
+    if not plan[1]:
+        return base.copy()
+    result = np.zeros(len(base), dtype=bool)
+    for _, predicates in plan[1]:
+        mask = base.copy()
+        for predicate in predicates:
+            if predicate[0] != "top":
+                mask &= evaluatePredicate(predicate, index, camera)
+        # highest/lowest pick among the buildings matching the rest of the group
+        for predicate in predicates:
+            if predicate[0] == "top":
+                _, column, count, descending = predicate
+                mask = topMask(index[column], mask, count, descending)
+        result |= mask
+    return result
 
 # ------------------------------------------------------------------------
 #    Operator
@@ -188,29 +493,48 @@ class QuerySelector(Operator):
     def execute(self, context):        
 #        home = sys.exec_prefix
         query = bpy.data.scenes['Scene'].Properties.query
-        # tokenization
-        tokens = nltk.word_tokenize(query)
-        # lemmatization
-        lemmatizer = WordNetLemmatizer()
-        lemmatized_tokens = [lemmatizer.lemmatize(token) for token in tokens]
-        # tag the pos
-#        tagged_tokens = SennaTagger(home+'/senna').tag(lemmatized_tokens)
-        tagged_tokens = nltk.pos_tag(lemmatized_tokens)
-        nouns = [token for token, pos in tagged_tokens if pos.startswith('N')]
-        adjs = [token for token, pos in tagged_tokens if pos.startswith('JJ')]
-        verbs = [token for token, pos in tagged_tokens if pos.startswith('VB')]
-        cons = [token for token, pos in tagged_tokens if pos.startswith('IN')]
-        numbers = [token for token, pos in tagged_tokens if pos.startswith('CD')]
-        if "building" in nouns: 
-            if adjs is not None:    
-                selectObjectsByHeight(context, adjs, numbers)
-            if "constructed" in verbs or "demolished" in verbs or "destroyed" in verbs:                
-                selectObjectsByDate(context, verbs, cons, numbers)
-            if "left" in adjs or "right" in adjs or "left" in nouns or "right" in nouns:    
-                selectObjectsByPosition(context, adjs)
-                selectObjectsByPosition(context, nouns)                             
+        plan = parseQuery(query)
+        if plan is not None:
+            index = attributeIndex(context.scene)
+            # the query narrows the current selection, or searches all buildings when nothing is selected
+            base = selectedMask(context, index)
+            if not base.any():
+                base[:] = True
+            applySelection(index, evaluatePlan(plan, index, base, context.scene.camera))
 
         return {'FINISHED'}
+class DatabaseQuery(Operator):
+    """Import only the buildings matching the query from the 3D City Database"""
+    bl_label = "Import Matching Buildings"
+    bl_idname = "query.database"
+    
+    def execute(self, context):
+        importer = importerModule()
+        if importer is None:
+            self.report({'ERROR'}, "The 3DCityDB Importer/Exporter add-on has to be enabled")
+            return {'CANCELLED'}
+        props = context.scene.MyProperties
+        if props.host == "" or props.name == "" or props.user == "" or props.password == "" or props.sql == "":
+            self.report({'WARNING'}, "Please enter all database Information!")
+            return {'CANCELLED'}
+        plan = parseQuery(context.scene.Properties.query)
+        if plan is None:
+            self.report({'WARNING'}, "The query does not ask for buildings")
+            return {'CANCELLED'}
+        condition, params, dropped = planToSQL(plan)
+        # a group of camera conditions only would import the whole city
+        if dropped and any(groupToSQL(predicates, "b")[0] == "TRUE" for _, predicates in plan[1]):
+            self.report({'WARNING'}, "Conditions relative to the camera cannot be applied in the database, "
+                                     "add a condition on height or year")
+            return {'CANCELLED'}
+        # replace the scene content like Database Connect does
+        importer.clearAll()
+        with importer.instrumented(context.scene):
+            importer.importScene(context.scene, context.collection, condition, params)
+        if dropped:
+            self.report({'INFO'}, "Conditions relative to the camera were not applied in the database")
+        return {'FINISHED'}
+
 # ------------------------------------------------------------------------
 #    Scene Properties
 # ------------------------------------------------------------------------
@@ -241,6 +565,7 @@ class Natural_Language_PT_Panel(Panel):
         layout.prop(props, "query")
         layout.operator(SelectObjectsInCameraView.bl_idname)
         layout.operator(QuerySelector.bl_idname)
+        layout.operator(DatabaseQuery.bl_idname)
 
 # ------------------------------------------------------------------------
 #    Registration
@@ -250,14 +575,17 @@ classes = (
         Natural_Language_PT_Panel,
         Properties,
         QuerySelector,
+        DatabaseQuery,
         )
 
 def register():
     for cls in classes:
         register_class(cls)
     bpy.types.Scene.Properties = bpy.props.PointerProperty(type=Properties)
+    bpy.app.handlers.depsgraph_update_post.append(invalidate_caches)
     
 def unregister():
+    bpy.app.handlers.depsgraph_update_post.remove(invalidate_caches)
     for cls in reversed(classes):
         unregister_class(cls)
     del bpy.types.Scene.Properties
@@ -0,0 +1,86 @@
+"""Compare per-row from_pydata mesh creation with the batched foreach_set builder.
+
+Run inside Blender:
+    blender --background --factory-startup --python benchmarks/bench_mesh_build.py -- 10000 100000 1000000
+"""
+import importlib.util
+import json
+import os
+import sys
+import time
+
+import bpy
+
+ADDON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                     "3DCityDB_Blender_Importer_Exporter.py")
+SURFACES_PER_BUILDING = 10
+
+def loadAddon():
+    spec = importlib.util.spec_from_file_location("citydb_importer", ADDON)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def syntheticRows(polygons):
+    """Rows shaped like the default query: one quad wall per row, ten rows per building"""
+    for i in range(polygons):
+        x = float(i % 1000) * 20.0 + 390000.0
+        y = float(i // 1000) * 20.0 + 5800000.0
+        ring = [[x, y, 0.0], [x + 10.0, y, 0.0], [x + 10.0, y, 10.0], [x, y, 10.0], [x, y, 0.0]]
+        yield {
+            "building_id": i // SURFACES_PER_BUILDING,
+            "gmlid": "BLDG_%d" % (i // SURFACES_PER_BUILDING),
+            "height": 10.0,
+            "year_of_construction": None,
+            "year_of_demolition": None,
+            "geometry": json.dumps({"type": "MultiPolygon", "coordinates": [[ring]]}),
+        }
+
+def legacyParser(rows, context):
+    """The previous import path: tuples per point and one from_pydata call per row"""
+    for row in rows:
+        geometry = json.loads(row["geometry"])
+        vertices = []
+        for arrays in geometry["coordinates"]:
+            for array in arrays:
+                for point in array[:-1]:
+                    vertices.append(tuple(point))
+        faces = [tuple(range(len(vertices)))]
+        new_mesh = bpy.data.meshes.new(row["gmlid"])
+        new_mesh.from_pydata(vertices, [], faces)
+        new_mesh.update()
+        new_object = bpy.data.objects.new(row["gmlid"], new_mesh)
+        context.collection.objects.link(new_object)
+
+def clearScene():
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj)
+    for mesh in list(bpy.data.meshes):
+        bpy.data.meshes.remove(mesh)
+
+def timeRun(function, polygons):
+    clearScene()
+    rows = list(syntheticRows(polygons))
+    start = time.perf_counter()
+    function(rows)
+    elapsed = time.perf_counter() - start
+    clearScene()
+    return elapsed
+
+def main():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    sizes = [int(arg) for arg in argv] or [10000, 100000, 1000000]
+    addon = loadAddon()
+    context = bpy.context
+    paths = (
+        ("from_pydata per row", lambda rows: legacyParser(rows, context)),
+        ("foreach_set per row", lambda rows: addon.geojsonParser(rows, context, "SURFACE")),
+        ("foreach_set per building", lambda rows: addon.geojsonParser(rows, context, "BUILDING")),
+    )
+    print("%-28s" % "polygons" + "".join("%14d" % size for size in sizes))
+    for label, function in paths:
+        timings = [timeRun(function, size) for size in sizes]
+        print("%-28s" % label + "".join("%13.2fs" % timing for timing in timings))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Time the import and export hot paths of the add-on without Blender and without a database.
+
+Runs with plain Python against the stubs in stubs.py and the rows of synthetic.py:
+    python benchmarks/bench_pipeline.py --buildings 5000 --json timings.json
+    python benchmarks/bench_pipeline.py --baseline timings.json --tolerance 1.5
+
+With --baseline the exit status is 1 when a benchmark is slower than its baseline time times the tolerance,
+baselines should come from the same machine.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stubs
+from synthetic import syntheticRows
+
+ADDON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                     "3DCityDB_Blender_Importer_Exporter.py")
+
+class CopyCursor:
+    """Cursor that reads the COPY data like the server would and drops it"""
+    def copy_expert(self, sql, buffer):
+        buffer.read()
+
+def loadAddon():
+    bpy = stubs.installBpy()
+    stubs.installPsycopg2()
+    spec = importlib.util.spec_from_file_location("citydb_importer", ADDON)
+    addon = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(addon)
+    return bpy, addon
+
+def buildScene(bpy, addon, records, grouping):
+    context = stubs.reset(bpy)
+    addon.buildObjects(records, context.collection, grouping)
+    return context
+
+def cacheRoundTrip(addon, records):
+    directory = os.path.join(tempfile.mkdtemp(), "entry")
+    try:
+        for _ in addon.cacheRecords(records, directory):
+            pass
+        for _ in addon.cachedRecords(directory):
+            pass
+    finally:
+        shutil.rmtree(os.path.dirname(directory))
+
+def fileExport(write, context, name, *args):
+    directory = tempfile.mkdtemp()
+    try:
+        write(os.path.join(directory, name), context, *args)
+    finally:
+        shutil.rmtree(directory)
+
+def benchmarks(bpy, addon, buildings):
+    """Name, item count, setup and timed function of every benchmark"""
+    wkb = list(syntheticRows(buildings, "wkb"))
+    geojson = list(syntheticRows(buildings, "geojson"))
+    records = list(addon.decodeRows(wkb))
+    repeated = list(addon.decodeRows(syntheticRows(buildings, "wkb", shapes=20)))
+    columns = ("export_key",) + addon.EXPORT_ATTRIBUTES + ("geometry",)
+    empty = lambda: stubs.reset(bpy)
+    surfaces = lambda: buildScene(bpy, addon, records, "SURFACE")
+    return [
+        ("decode wkb", len(wkb), None, lambda: list(addon.decodeRows(wkb))),
+        ("decode geojson", len(geojson), None, lambda: list(addon.decodeRows(geojson))),
+        ("build per surface", len(records), empty,
+         lambda: addon.buildObjects(records, bpy.context.collection, "SURFACE")),
+        ("build per building", buildings, empty,
+         lambda: addon.buildObjects(records, bpy.context.collection, "BUILDING")),
+        ("build shared per building", buildings, empty,
+         lambda: addon.buildObjects(repeated, bpy.context.collection, "BUILDING", instancing=True)),
+        ("cache write and read", len(records), None, lambda: cacheRoundTrip(addon, records)),
+        ("export encode and copy", len(records), surfaces,
+         lambda: addon.copyRows(CopyCursor(), "blender_export_stage", columns,
+                                addon.exportRows(bpy.context.scene.objects, [], False, np.zeros(3), 25833), 10000)),
+        ("export cityjson", len(records), surfaces,
+         lambda: fileExport(addon.writeCityJSON, bpy.context, "scene.json", 25833)),
+        ("export geopackage", len(records), surfaces,
+         lambda: fileExport(addon.writeGeoPackage, bpy.context, "scene.gpkg", 25833, 10000)),
+        ("merge surfaces", len(records), surfaces, lambda: addon.mergeSurfaces(bpy.context)),
+    ]
+
+def run(bpy, addon, buildings, repeat):
+    """Best time of every benchmark and the stage statistics of its last run"""
+    results = {}
+    for name, items, setup, function in benchmarks(bpy, addon, buildings):
+        best = None
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            addon.resetStats()
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = {"seconds": best, "items": items, "stages": dict(addon.statsSnapshot())}
+    return results
+
+def regressions(results, baseline, tolerance):
+    """Benchmarks slower than their baseline time times the tolerance"""
+    slower = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is not None and result["seconds"] > reference["seconds"] * tolerance:
+            slower.append((name, result["seconds"], reference["seconds"]))
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--buildings", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stages", action="store_true", help="print the stage statistics of every benchmark")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    args = parser.parse_args()
+    bpy, addon = loadAddon()
+    results = run(bpy, addon, args.buildings, args.repeat)
+    print("{:<26}{:>12}{:>14}".format("benchmark", "seconds", "items/s"))
+    for name, result in results.items():
+        print("{:<26}{:>12.4f}{:>14.0f}".format(name, result["seconds"], result["items"] / result["seconds"]))
+        if args.stages:
+            for stage, entry in result["stages"].items():
+                print("    {:<22}{:>12.4f}{:>8} calls{:>10} items".format(
+                    stage, entry["seconds"], entry["calls"], entry["items"]))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        slower = regressions(results, baseline, args.tolerance)
+        for name, seconds, reference in slower:
+            print("REGRESSION {}: {:.4f}s, baseline {:.4f}s".format(name, seconds, reference))
+        if slower:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Stand-ins for bpy and psycopg2, enough to run the import and export hot paths without Blender or a database.
+
+The stub meshes keep their attributes in numpy arrays and copy them on foreach_set and foreach_get like
+Blender does, so the measured time covers the add-on's own work and comparable data movement.
+"""
+import sys
+import tempfile
+import types
+
+import numpy as np
+
+# width and dtype of the mesh attributes the add-on reads and writes
+MESH_ATTRIBUTES = {
+    "vertices": {"co": (3, np.float32)},
+    "loops": {"vertex_index": (1, np.int32)},
+    "polygons": {"loop_start": (1, np.int32), "loop_total": (1, np.int32)},
+}
+
+class MeshElements:
+    """Vertices, loops or polygons of a stub mesh"""
+    def __init__(self, attributes):
+        self._attributes = attributes
+        self._data = {name: np.zeros(0, dtype=dtype) for name, (_, dtype) in attributes.items()}
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def add(self, count):
+        self._length += count
+        for name, (width, dtype) in self._attributes.items():
+            data = np.zeros(self._length * width, dtype=dtype)
+            data[:len(self._data[name])] = self._data[name]
+            self._data[name] = data
+
+    def foreach_set(self, name, values):
+        width, dtype = self._attributes[name]
+        self._data[name] = np.array(values, dtype=dtype).ravel()[:self._length * width]
+
+    def foreach_get(self, name, out):
+        out[:] = self._data[name]
+
+class IDProperties:
+    """Custom properties of a datablock"""
+    def __getitem__(self, key):
+        return self._properties[key]
+
+    def __setitem__(self, key, value):
+        self._properties[key] = value
+
+    def __contains__(self, key):
+        return key in self._properties
+
+    def keys(self):
+        return self._properties.keys()
+
+    def get(self, key, default=None):
+        return self._properties.get(key, default)
+
+class Mesh(IDProperties):
+    def __init__(self, name):
+        self.name = name
+        self.users = 0
+        self._properties = {}
+        self.vertices = MeshElements(MESH_ATTRIBUTES["vertices"])
+        self.loops = MeshElements(MESH_ATTRIBUTES["loops"])
+        self.polygons = MeshElements(MESH_ATTRIBUTES["polygons"])
+
+    def update(self, calc_edges=False):
+        pass
+
+class Object(IDProperties):
+    """Mesh object with custom properties"""
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+        self.type = "MESH"
+        self.matrix_world = np.identity(4)
+        self.location = np.zeros(3)
+        self.users_collection = []
+        self._properties = {}
+        if data is not None:
+            data.users += 1
+
+class CollectionObjects(list):
+    def __init__(self, collection):
+        super().__init__()
+        self._collection = collection
+
+    def link(self, obj):
+        self.append(obj)
+        obj.users_collection.append(self._collection)
+
+class Collection:
+    def __init__(self, name):
+        self.name = name
+        self.objects = CollectionObjects(self)
+
+class Meshes(list):
+    def __init__(self):
+        super().__init__()
+        self._names = {}
+        self._created = 0
+
+    def new(self, name):
+        # unique names like Blender, shared meshes are looked up by name
+        self._created += 1
+        mesh = Mesh("{}.{:03d}".format(name, self._created))
+        self.append(mesh)
+        self._names[mesh.name] = mesh
+        return mesh
+
+    def get(self, name, default=None):
+        return self._names.get(name, default)
+
+    def remove(self, mesh):
+        list.remove(self, mesh)
+        del self._names[mesh.name]
+
+class Objects(list):
+    def new(self, name, data):
+        obj = Object(name, data)
+        self.append(obj)
+        return obj
+
+    def remove(self, obj):
+        for collection in obj.users_collection:
+            collection.objects.remove(obj)
+        obj.users_collection = []
+        if obj.data is not None:
+            obj.data.users -= 1
+        list.remove(self, obj)
+
+class Scene(IDProperties):
+    def __init__(self, collection):
+        self.collection = collection
+        self.camera = None
+        self._properties = {}
+
+    @property
+    def objects(self):
+        # every benchmark object is linked to the scene collection
+        return list(self.collection.objects)
+
+class Context:
+    def __init__(self):
+        self.collection = Collection("Collection")
+        self.scene = Scene(self.collection)
+
+class Data:
+    def __init__(self):
+        self.meshes = Meshes()
+        self.objects = Objects()
+
+class Timers:
+    def __init__(self):
+        self._functions = set()
+
+    def register(self, function, first_interval=0.0, persistent=False):
+        self._functions.add(function)
+
+    def unregister(self, function):
+        self._functions.discard(function)
+
+    def is_registered(self, function):
+        return function in self._functions
+
+def reset(bpy):
+    """Start from an empty file"""
+    bpy.data = Data()
+    bpy.context = Context()
+    return bpy.context
+
+def module(name, **attributes):
+    stub = types.ModuleType(name)
+    stub.__dict__.update(attributes)
+    sys.modules[name] = stub
+    return stub
+
+def propertyStub(**options):
+    return None
+
+def installBpy(version=(3, 6, 0)):
+    """Register a stub bpy in sys.modules and return it"""
+    props = module("bpy.props", **{name: propertyStub for name in (
+        "StringProperty", "PointerProperty", "IntProperty", "BoolProperty", "EnumProperty",
+        "FloatProperty", "CollectionProperty")})
+    bpy_types = module("bpy.types", Panel=type("Panel", (), {}), Operator=type("Operator", (), {}),
+                       PropertyGroup=type("PropertyGroup", (), {}), Object=Object, Scene=type("Scene", (), {}))
+    utils = module("bpy.utils", register_class=lambda cls: None, unregister_class=lambda cls: None,
+                   user_resource=lambda resource, path="", create=False: tempfile.mkdtemp(prefix=path))
+    handlers = module("bpy.app.handlers", persistent=lambda function: function,
+                      depsgraph_update_post=[], load_post=[])
+    app = module("bpy.app", version=version, handlers=handlers, timers=Timers())
+    path = module("bpy.path", abspath=lambda path: path)
+    ops = types.SimpleNamespace(object=types.SimpleNamespace(select_all=lambda action: None,
+                                                             delete=lambda: None))
+    bpy = module("bpy", props=props, types=bpy_types, utils=utils, app=app, path=path, ops=ops)
+    io_utils = module("bpy_extras.io_utils", ExportHelper=type("ExportHelper", (), {}))
+    module("bpy_extras", io_utils=io_utils)
+    reset(bpy)
+    return bpy
+
+def installPsycopg2():
+    """Register a stub psycopg2 unless the real one is installed, no connection is ever made"""
+    try:
+        import psycopg2
+        return psycopg2
+    except ImportError:
+        pass
+    extras = module("psycopg2.extras", RealDictCursor=object)
+    pool = module("psycopg2.pool", ThreadedConnectionPool=object)
+    return module("psycopg2", Error=Exception, extras=extras, pool=pool)
@@ -0,0 +1,67 @@
+"""Rows shaped like the result of the default import query, generated without a database.
+
+Every building is a prism over a random convex footprint with one row for the ground surface, one for
+the roof and one per wall, like the thematic surfaces of an LoD2 building in 3DCityDB.
+"""
+import json
+import struct
+
+import numpy as np
+
+# ISO WKB types of ST_AsBinary for 3D geometries
+WKB_POLYGON_Z = 1003
+WKB_MULTIPOLYGON_Z = 1006
+
+def buildingSurfaces(rng, x, y):
+    """Exterior rings of the surfaces of one building, closed and counter-clockwise seen from outside"""
+    corners = int(rng.integers(4, 9))
+    angles = np.sort(rng.uniform(0.0, 2.0 * np.pi, corners))
+    radius = rng.uniform(5.0, 20.0)
+    height = rng.uniform(3.0, 40.0)
+    footprint = np.column_stack((x + radius * np.cos(angles), y + radius * np.sin(angles), np.zeros(corners)))
+    roof = footprint + (0.0, 0.0, height)
+    surfaces = [("GroundSurface", footprint[::-1]), ("RoofSurface", roof)]
+    for i in range(corners):
+        j = (i + 1) % corners
+        surfaces.append(("WallSurface", np.array([footprint[i], footprint[j], roof[j], roof[i]])))
+    return height, [(kind, np.vstack((ring, ring[:1]))) for kind, ring in surfaces]
+
+def encodeWKB(ring):
+    """ISO WKB MultiPolygon Z with one polygon, as returned by ST_AsBinary"""
+    return (struct.pack("<BII", 1, WKB_MULTIPOLYGON_Z, 1) + struct.pack("<BIII", 1, WKB_POLYGON_Z, 1, len(ring))
+            + np.ascontiguousarray(ring, dtype="<f8").tobytes())
+
+def encodeGeoJSON(ring):
+    """GeoJSON MultiPolygon with one polygon, as returned by ST_AsGeoJSON"""
+    return json.dumps({"type": "MultiPolygon", "coordinates": [[ring.tolist()]]})
+
+def syntheticRows(buildings, encoding="wkb", seed=0, shapes=0):
+    """Rows of the default import query for a grid of buildings, ordered by building id
+
+    With shapes above 0 the buildings repeat that many shapes, like a generated district.
+    """
+    rng = np.random.default_rng(seed)
+    columns = int(np.ceil(np.sqrt(buildings)))
+    for building in range(buildings):
+        # projected coordinates of a metric CRS, large enough to show float32 precision problems
+        x = 390000.0 + 50.0 * (building % columns)
+        y = 5800000.0 + 50.0 * (building // columns)
+        if shapes > 0:
+            rng = np.random.default_rng((seed, building % shapes))
+        height, surfaces = buildingSurfaces(rng, x, y)
+        for surface, (kind, ring) in enumerate(surfaces):
+            if encoding == "wkb":
+                geometry = memoryview(encodeWKB(ring))
+            elif encoding == "hex":
+                geometry = encodeWKB(ring).hex()
+            else:
+                geometry = encodeGeoJSON(ring)
+            yield {
+                "building_id": building + 1,
+                "surface_gmlid": "{}_{}_{}".format(kind, building + 1, surface),
+                "height": height,
+                "gmlid": "BLDG_{:08d}".format(building + 1),
+                "geometry": geometry,
+                "year_of_construction": None,
+                "year_of_demolition": None,
+            }